@@ -22,7 +22,13 @@ admin.site.register(ExamPaper)
 admin.site.register(ObtainedMark)
 admin.site.register(Month)
 admin.site.register(Receipt)
+admin.site.register(ReceiptSequence)
+admin.site.register(ReceiptSettlement)
+admin.site.register(StudentFeeAccount)
+admin.site.register(FeeCollection)
 admin.site.register(Attendance)
 admin.site.register(EmployeeAttendance)
 admin.site.register(Role)
 
+admin.site.register(MonthlyAttendance)
+admin.site.register(ExamResult)
@@ -0,0 +1,447 @@
+"""
+Server-side receipt and fee statement PDFs.
+
+Documents are plain dicts built from the database (`get_receipt_documents`,
+`get_statement_documents`) so they can be shipped to worker processes as-is.
+`render_documents` renders the ones missing from the cache (on a shared
+process pool for large batches) and stores every PDF under DOCUMENT_CACHE_DIR,
+named by the hash of the document, its letterhead image and RENDERER_VERSION,
+so a reprint is a file read. Rendering only needs Pillow and its bundled font,
+so it works offline.
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+import zipfile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal
+from functools import lru_cache
+
+import django
+from django.conf import settings
+from PIL import Image, ImageDraw, ImageFont
+
+from . import models
+
+
+# bump whenever the layout changes so cached documents are rendered again
+RENDERER_VERSION = 1
+
+PAGE_SIZE = (1240, 1754)  # A4 at 150 dpi
+RESOLUTION = 150
+MARGIN = 90
+LOGO_SIZE = (140, 140)
+
+FEE_ITEMS = [
+    ('admission_fees', 'Admission Fees'),
+    ('registration_fees', 'Registration Fees'),
+    ('monthly_fees', 'Monthly Fees'),
+    ('transport_fees', 'Transport Fees'),
+    ('old_fees', 'Old Fees'),
+    ('late_fees', 'Late Fees'),
+    ('fines', 'Fines'),
+    ('other_fees', 'Other Fees'),
+]
+
+FEE_TOTALS = [
+    ('total_fees', 'Total'),
+    ('concession_amount', 'Concession'),
+    ('net_fees', 'Net Payable'),
+    ('deposit_fees', 'Deposited'),
+    ('remaining_fees', 'Remaining'),
+]
+
+
+def get_cache_dir():
+    return getattr(settings, 'DOCUMENT_CACHE_DIR', None) or os.path.join(settings.MEDIA_ROOT, 'documents')
+
+
+def get_letterhead(school):
+    photo = None
+    if school.photo:
+        try:
+            photo = school.photo.path
+        except NotImplementedError:  # storages without local paths
+            photo = None
+
+    address = ', '.join(part for part in (school.address, school.town_village_city, school.district, school.state, school.pincode) if part)
+    return {
+        'name': school.school_name or '',
+        'tag_line': school.tag_line or '',
+        'address': address,
+        'phone': school.phone or '',
+        'photo': photo,
+    }
+
+
+def get_student_details(student):
+    return {
+        'name': student.student_full_name or '',
+        'father_name': student.father_full_name or '',
+        'enrollment_id': student.enrollmentId,
+        'class_name': student.classOfAdmission.className if student.classOfAdmission else '',
+        'roll_no': student.rollNo,
+    }
+
+
+def get_receipt_documents(receipts):
+    """One document per receipt of the queryset, loaded with three queries."""
+    receipts = receipts.select_related('student__school', 'student__classOfAdmission').prefetch_related('months').order_by('receipt_date', 'id')
+
+    letterheads = {}
+    documents = []
+    for receipt in receipts:
+        school = receipt.student.school
+        if school.id not in letterheads:
+            letterheads[school.id] = get_letterhead(school)
+
+        documents.append({
+            'kind': 'receipt',
+            'filename': f"{receipt.receipt_no or receipt.id}.pdf",
+            'letterhead': letterheads[school.id],
+            'receipt_no': receipt.receipt_no or '',
+            'date': str(receipt.receipt_date or ''),
+            'student': get_student_details(receipt.student),
+            'months': [month.name for month in sorted(receipt.months.all(), key=lambda month: month.id)],
+            'items': [(label, str(getattr(receipt, field))) for field, label in FEE_ITEMS if getattr(receipt, field)],
+            'totals': [(label, str(getattr(receipt, field) or 0)) for field, label in FEE_TOTALS],
+            'payment_mode': receipt.payment_mode or '',
+            'remarks': receipt.remarks or '',
+        })
+    return documents
+
+
+def get_statement_documents(students, date_from=None, date_to=None):
+    """One fee statement per student listing their receipts in the period."""
+    students = list(students.select_related('school', 'classOfAdmission').order_by('classOfAdmission_id', 'rollNo', 'id'))
+
+    receipts = models.Receipt.objects.filter(student__in=students).prefetch_related('months').order_by('receipt_date', 'id')
+    if date_from:
+        receipts = receipts.filter(receipt_date__gte=date_from)
+    if date_to:
+        receipts = receipts.filter(receipt_date__lte=date_to)
+
+    receipts_by_student = defaultdict(list)
+    for receipt in receipts:
+        receipts_by_student[receipt.student_id].append(receipt)
+
+    letterheads = {}
+    documents = []
+    for student in students:
+        if student.school_id not in letterheads:
+            letterheads[student.school_id] = get_letterhead(student.school)
+
+        rows = []
+        totals = defaultdict(Decimal)
+        for receipt in receipts_by_student[student.id]:
+            rows.append([
+                str(receipt.receipt_date or ''),
+                receipt.receipt_no or '',
+                ', '.join(month.name for month in sorted(receipt.months.all(), key=lambda month: month.id)),
+                str(receipt.net_fees or 0),
+                str(receipt.deposit_fees or 0),
+                str(receipt.remaining_fees or 0),
+            ])
+            for field in ('net_fees', 'deposit_fees', 'remaining_fees'):
+                totals[field] += getattr(receipt, field) or 0
+
+        documents.append({
+            'kind': 'statement',
+            'filename': f"statement-{student.enrollmentId}.pdf",
+            'letterhead': letterheads[student.school_id],
+            'period': [str(date_from or ''), str(date_to or '')],
+            'student': get_student_details(student),
+            'rows': rows,
+            'totals': [str(totals[field]) for field in ('net_fees', 'deposit_fees', 'remaining_fees')],
+        })
+    return documents
+
+
+def format_amount(value):
+    return f"{Decimal(value):,.2f}" if value not in (None, '', 'None') else '-'
+
+
+@lru_cache(maxsize=None)
+def get_font(size):
+    try:
+        return ImageFont.load_default(size)
+    except (ImportError, AttributeError):  # Pillow without FreeType only has the small bitmap font
+        return ImageFont.load_default()
+
+
+class PageWriter:
+    """Draws text top to bottom, starting a new page (with the letterhead) when one fills up."""
+
+    def __init__(self, letterhead, title):
+        self.letterhead = letterhead
+        self.title = title
+        self.pages = []
+        self.new_page()
+
+    def new_page(self):
+        page = Image.new('RGB', PAGE_SIZE, 'white')
+        self.pages.append(page)
+        self.draw = ImageDraw.Draw(page)
+        self.y = MARGIN
+        self.draw_letterhead(page)
+        self.text(PAGE_SIZE[0] // 2, self.title, size=32, anchor='ma')
+        self.y += 50
+
+    def draw_letterhead(self, page):
+        left = MARGIN
+        if self.letterhead['photo']:
+            try:
+                with Image.open(self.letterhead['photo']) as logo:
+                    logo = logo.convert('RGBA')
+                    logo.thumbnail(LOGO_SIZE)
+                    page.paste(logo, (MARGIN, self.y), logo)
+                left += LOGO_SIZE[0] + 30
+            except OSError:  # missing or unreadable image, keep the text letterhead
+                pass
+
+        top = self.y
+        self.text(left, self.letterhead['name'], size=42)
+        self.y += 54
+        for line in (self.letterhead['tag_line'], self.letterhead['address'], self.letterhead['phone']):
+            if line:
+                self.text(left, line, size=22)
+                self.y += 30
+        self.y = max(self.y, top + LOGO_SIZE[1]) + 20
+        self.rule(width=3)
+        self.y += 30
+
+    def ensure_space(self, height):
+        if self.y + height > PAGE_SIZE[1] - MARGIN:
+            self.new_page()
+
+    def text(self, x, text, size=24, anchor='la'):
+        self.draw.text((x, self.y), str(text), fill='black', font=get_font(size), anchor=anchor)
+
+    def line(self, columns, size=24, height=36):
+        """columns: [(x, text, anchor)] drawn on one line."""
+        self.ensure_space(height)
+        for x, text, anchor in columns:
+            self.text(x, text, size=size, anchor=anchor)
+        self.y += height
+
+    def rule(self, width=1):
+        self.draw.line([(MARGIN, self.y), (PAGE_SIZE[0] - MARGIN, self.y)], fill='black', width=width)
+
+    def to_pdf(self):
+        buffer = io.BytesIO()
+        self.pages[0].save(buffer, 'PDF', resolution=RESOLUTION, save_all=True, append_images=self.pages[1:])
+        return buffer.getvalue()
+
+
+def draw_student_details(writer, student):
+    right = PAGE_SIZE[0] // 2 + 40
+    writer.line([(MARGIN, f"Student: {student['name']}", 'la'), (right, f"Enrollment ID: {student['enrollment_id']}", 'la')])
+    writer.line([(MARGIN, f"Father: {student['father_name']}", 'la'), (right, f"Class: {student['class_name']}   Roll No: {student['roll_no'] or '-'}", 'la')])
+
+
+def render_receipt(document):
+    writer = PageWriter(document['letterhead'], 'FEE RECEIPT')
+    right = PAGE_SIZE[0] - MARGIN
+
+    writer.line([(MARGIN, f"Receipt No: {document['receipt_no']}", 'la'), (right, f"Date: {document['date']}", 'ra')])
+    draw_student_details(writer, document['student'])
+    writer.line([(MARGIN, f"Months: {', '.join(document['months']) or '-'}", 'la')])
+    writer.y += 20
+
+    writer.rule()
+    writer.y += 12
+    writer.line([(MARGIN, 'Particulars', 'la'), (right, 'Amount', 'ra')], size=26)
+    writer.rule()
+    writer.y += 12
+    for label, amount in document['items']:
+        writer.line([(MARGIN, label, 'la'), (right, format_amount(amount), 'ra')])
+    writer.rule()
+    writer.y += 12
+    for label, amount in document['totals']:
+        writer.line([(PAGE_SIZE[0] // 2, label, 'la'), (right, format_amount(amount), 'ra')])
+
+    writer.y += 20
+    writer.line([(MARGIN, f"Payment mode: {document['payment_mode'] or '-'}", 'la')])
+    if document['remarks']:
+        writer.line([(MARGIN, f"Remarks: {document['remarks']}", 'la')])
+    writer.y += 80
+    writer.line([(right, 'Authorised signature', 'ra')], size=22)
+    return writer.to_pdf()
+
+
+def render_statement(document):
+    writer = PageWriter(document['letterhead'], 'FEE STATEMENT')
+    date_from, date_to = document['period']
+    columns = [MARGIN, MARGIN + 170, MARGIN + 470, 860, 960, PAGE_SIZE[0] - MARGIN]
+
+    draw_student_details(writer, document['student'])
+    writer.line([(MARGIN, f"Period: {date_from or 'start'} to {date_to or 'today'}", 'la')])
+    writer.y += 20
+
+    def draw_header():
+        writer.rule()
+        writer.y += 12
+        writer.line([
+            (columns[0], 'Date', 'la'), (columns[1], 'Receipt No', 'la'), (columns[2], 'Months', 'la'),
+            (columns[3], 'Net', 'ra'), (columns[4] + 60, 'Paid', 'ra'), (columns[5], 'Due', 'ra'),
+        ], size=22)
+        writer.rule()
+        writer.y += 12
+
+    draw_header()
+    for date, receipt_no, months, net, deposit, remaining in document['rows']:
+        pages = len(writer.pages)
+        writer.ensure_space(34)
+        if len(writer.pages) != pages:
+            draw_header()
+        writer.line([
+            (columns[0], date, 'la'), (columns[1], receipt_no, 'la'), (columns[2], months[:28], 'la'),
+            (columns[3], format_amount(net), 'ra'), (columns[4] + 60, format_amount(deposit), 'ra'), (columns[5], format_amount(remaining), 'ra'),
+        ], size=20, height=34)
+
+    if not document['rows']:
+        writer.line([(MARGIN, 'No receipts in this period.', 'la')], size=22)
+    writer.rule()
+    writer.y += 12
+    net, deposit, remaining = document['totals']
+    writer.line([
+        (columns[0], 'Total', 'la'),
+        (columns[3], format_amount(net), 'ra'), (columns[4] + 60, format_amount(deposit), 'ra'), (columns[5], format_amount(remaining), 'ra'),
+    ], size=22)
+    return writer.to_pdf()
+
+
+RENDERERS = {
+    'receipt': render_receipt,
+    'statement': render_statement,
+}
+
+
+def render_document(document):
+    return RENDERERS[document['kind']](document)
+
+
+def get_document_key(document):
+    """Hash of everything that ends up on the page, including the letterhead image file."""
+    digest = hashlib.sha256()
+    digest.update(f"v{RENDERER_VERSION}".encode())
+    digest.update(json.dumps(document, sort_keys=True, default=str).encode())
+    photo = document['letterhead']['photo']
+    if photo and os.path.exists(photo):
+        stat = os.stat(photo)
+        digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+# batches up to this size render in the request process, a pool isn't worth it
+INLINE_RENDER_LIMIT = 8
+
+render_pools = {}
+render_pools_lock = threading.Lock()
+
+
+def get_render_pool(workers):
+    """
+    Process pool shared by every request of this process, started on first use.
+    Workers boot Django once (spawned workers import this module, which needs
+    the app registry) and are then reused for every batch.
+    """
+    with render_pools_lock:
+        pool = render_pools.get(workers)
+        if pool is None:
+            pool = render_pools[workers] = ProcessPoolExecutor(max_workers=workers, initializer=django.setup)
+        return pool
+
+
+def discard_render_pool(workers):
+    with render_pools_lock:
+        pool = render_pools.pop(workers, None)
+    if pool:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def prune_cache(cache_dir, max_size):
+    """Delete the least recently used PDFs until the cache is under max_size bytes."""
+    entries = []
+    total = 0
+    with os.scandir(cache_dir) as scan:
+        for entry in scan:
+            if entry.name.endswith('.pdf') and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:  # pruned by another process
+            pass
+        total -= size
+
+
+def render_documents(documents, workers=None):
+    """
+    Return [(filename, pdf bytes)] for the documents. Cached PDFs are read back;
+    the rest are rendered and written to the cache, in process for small
+    batches or workers=0 and on the shared process pool otherwise. The cache is
+    kept under DOCUMENT_CACHE_MAX_SIZE bytes, least recently used first out.
+    """
+    cache_dir = get_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+    paths = [os.path.join(cache_dir, f"{get_document_key(document)}.pdf") for document in documents]
+
+    missing = {}
+    for document, path in zip(documents, paths):
+        if path not in missing and not os.path.exists(path):
+            missing[path] = document
+
+    if missing:
+        if workers is None:
+            workers = getattr(settings, 'DOCUMENT_RENDER_WORKERS', None) or os.cpu_count() or 1
+        if workers <= 1 or len(missing) <= INLINE_RENDER_LIMIT:
+            rendered = map(render_document, missing.values())
+        else:
+            pool = get_render_pool(workers)
+            try:
+                rendered = list(pool.map(render_document, missing.values(), chunksize=max(1, len(missing) // (workers * 4))))
+            except BrokenProcessPool:
+                # a worker died, start a fresh pool next time and finish this batch here
+                discard_render_pool(workers)
+                rendered = map(render_document, missing.values())
+
+        for path, pdf in zip(missing, rendered):
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as file:
+                file.write(pdf)
+            os.replace(temp_path, path)
+
+    results = []
+    for document, path in zip(documents, paths):
+        try:
+            with open(path, 'rb') as file:
+                pdf = file.read()
+            if path not in missing:
+                os.utime(path)  # a hit keeps the file at the young end of the cache
+        except FileNotFoundError:  # pruned by another request in the meantime
+            pdf = render_document(document)
+        results.append((document['filename'], pdf))
+
+    max_size = getattr(settings, 'DOCUMENT_CACHE_MAX_SIZE', None)
+    if missing and max_size:
+        prune_cache(cache_dir, max_size)
+    return results
+
+
+def bundle_documents(rendered):
+    """Zip [(filename, pdf bytes)] into one archive for batch printing."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for filename, pdf in rendered:
+            archive.writestr(filename, pdf)
+    return buffer.getvalue()
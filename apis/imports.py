@@ -0,0 +1,274 @@
+"""
+Streaming spreadsheet imports.
+
+`read_rows` yields one dict per data row of a CSV or XLSX file without loading
+the whole file; the importers validate each row against lookups preloaded in a
+couple of queries and insert in bulk_create batches inside one transaction.
+Nothing is saved when any row fails, and the errors come back per line.
+XLSX needs the optional openpyxl package.
+"""
+import csv
+import datetime
+import io
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+
+from . import models
+from .search import index_students
+from .utils import normalize_text
+
+
+MAX_ERRORS = 100
+
+DATE_FORMATS = ['%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y']
+
+
+def get_header_key(value):
+    return normalize_text(str(value or '')).casefold().replace(' ', '_')
+
+
+def get_row(header, values):
+    """{header: value} with every header column present; cells missing from a short row are None."""
+    values = list(values)
+    return {column: values[index] if index < len(values) else None for index, column in enumerate(header)}
+
+
+def read_rows(file, filename):
+    """Yield (line number, {header: value}) for the data rows of a CSV or XLSX upload."""
+    if filename.lower().endswith('.xlsx'):
+        try:
+            import openpyxl
+        except ImportError:
+            raise ValueError("XLSX files need the openpyxl package, upload a CSV instead")
+
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [get_header_key(value) for value in next(rows, [])]
+            for line, values in enumerate(rows, start=2):
+                if any(value not in (None, '') for value in values):
+                    yield line, get_row(header, values)
+        finally:
+            workbook.close()
+        return
+
+    text = io.TextIOWrapper(getattr(file, 'file', file), encoding='utf-8-sig', newline='')
+    try:
+        reader = csv.reader(text)
+        header = [get_header_key(value) for value in next(reader, [])]
+        for values in reader:
+            if any(value.strip() for value in values):
+                yield reader.line_num, get_row(header, values)
+    except UnicodeDecodeError:
+        raise ValueError("CSV files must be UTF-8 encoded")
+    finally:
+        text.detach()
+
+
+def parse_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    value = str(value or '').strip()
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format).date()
+        except ValueError:
+            pass
+    raise ValueError(f"Invalid date '{value}', use YYYY-MM-DD")
+
+
+def parse_amount(value):
+    try:
+        amount = Decimal(str(value).replace(',', '').strip())
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"Invalid amount '{value}'")
+    if not amount.is_finite() or amount <= 0:
+        raise ValueError(f"Amount must be a positive number, got '{value}'")
+    if amount != amount.quantize(Decimal('0.01')):
+        raise ValueError(f"Amount '{value}' has more than two decimal places")
+    return amount
+
+
+def bulk_import(model, rows, build, required_columns, batch_size=500, on_created=None, known_columns=None):
+    """
+    Build one `model` instance per row with build(row) (raising ValueError for
+    an invalid row) and bulk_create them in batches inside one transaction,
+    calling on_created(batch) after each insert when given. When
+    `known_columns` is given any other (non-blank) header is rejected rather
+    than dropped. Returns (created instances count, errors); nothing is saved
+    when there are errors. Only the current batch is held in memory.
+    """
+    def create(batch):
+        model.objects.bulk_create(batch)
+        if on_created is not None:
+            on_created(batch)
+
+    created = 0
+    errors = []
+    batch = []
+    with transaction.atomic():
+        for line, row in rows:
+            # every row carries the header's columns, so a missing one is a header problem
+            missing_columns = [column for column in required_columns if column not in row]
+            if missing_columns:
+                errors.append({'line': 1, 'message': f"Missing columns: {', '.join(missing_columns)}"})
+                break
+            if known_columns is not None:
+                unknown_columns = [column for column in row if column and column not in known_columns]
+                if unknown_columns:
+                    errors.append({'line': 1, 'message': f"Unknown columns: {', '.join(unknown_columns)}"})
+                    break
+
+            missing_values = [column for column in required_columns if row[column] is None or str(row[column]).strip() == '']
+            if missing_values:
+                errors.append({'line': line, 'message': f"Missing values: {', '.join(missing_values)}"})
+                if len(errors) >= MAX_ERRORS:
+                    break
+                continue
+
+            try:
+                batch.append(build(row))
+            except ValueError as e:
+                errors.append({'line': line, 'message': str(e)})
+                if len(errors) >= MAX_ERRORS:
+                    break
+
+            if len(batch) >= batch_size:
+                # after the first error the rest of the file is only validated
+                if not errors:
+                    create(batch)
+                created += len(batch)
+                batch = []
+
+        if errors:
+            transaction.set_rollback(True)
+            return 0, errors
+
+        create(batch)
+        created += len(batch)
+    return created, errors
+
+
+def import_income_expenses(school, rows, batch_size=500):
+    """
+    Insert IncomeExpense entries from `rows` (as yielded by read_rows) with the
+    columns date, head, amount and optionally particulars and type (income or
+    expense, needed when a head name exists for both). Returns
+    (created, errors) where errors is [{'line': ..., 'message': ...}];
+    nothing is saved when there are errors.
+    """
+    heads = {}
+    for head_id, name, head_type in models.ChartOfAccount.objects.filter(school=school).values_list('id', 'head', 'type'):
+        heads.setdefault(get_header_key(name), {})[head_type] = head_id
+
+    def build(row):
+        head_types = heads.get(get_header_key(row['head']))
+        if not head_types:
+            raise ValueError(f"Unknown head '{row['head']}'")
+        head_type = str(row.get('type') or '').strip().lower()
+        if head_type:
+            if head_type not in ('income', 'expense'):
+                raise ValueError(f"Type must be income or expense, got '{row['type']}'")
+            if head_type not in head_types:
+                raise ValueError(f"Head '{row['head']}' is not an {head_type} head")
+            head_id = head_types[head_type]
+        elif len(head_types) == 1:
+            head_id, = head_types.values()
+        else:
+            raise ValueError(f"Head '{row['head']}' is both income and expense, fill the type column")
+
+        return models.IncomeExpense(
+            school=school,
+            head_id=head_id,
+            date=parse_date(row['date']),
+            amount=parse_amount(row['amount']),
+            particulars=normalize_text(str(row.get('particulars') or ''))[:200] or None,
+        )
+
+    return bulk_import(models.IncomeExpense, rows, build, ('date', 'head', 'amount'), batch_size)
+
+
+# Student columns an admission file may fill; headers match them ignoring case,
+# spaces and underscores ("Student First Name" -> studentFirstName)
+STUDENT_IMPORT_EXCLUDED_FIELDS = {
+    'id', 'school', 'classOfAdmission', 'enrollmentId', 'photo', 'student_full_name', 'father_full_name',
+    'student_father_combined_name', 'search_name', 'search_name_father',
+}
+CLASS_COLUMNS = ('class', 'classname', 'classofadmission')
+
+
+def get_column_key(value):
+    return get_header_key(value).replace('_', '')
+
+
+def import_students(school, rows, batch_size=500):
+    """
+    Admit students from `rows` (as yielded by read_rows). Columns are matched to
+    Student fields and a class / classOfAdmission column is resolved by class
+    name; a column matching neither is rejected rather than dropped.
+    studentFirstName is required. enrollmentId and the name fields are filled
+    by Student.set_derived_fields and the search tokens by index_students since
+    bulk_create skips save().
+    Returns (created, errors) like import_income_expenses.
+    """
+    fields = {
+        get_column_key(field.name): field
+        for field in models.Student._meta.concrete_fields
+        if field.name not in STUDENT_IMPORT_EXCLUDED_FIELDS
+    }
+
+    classes = {}
+    for class_id, class_name in models.Class.objects.filter(school=school).values_list('id', 'className'):
+        # the same name twice can't be told apart
+        key = get_column_key(class_name)
+        classes[key] = None if key in classes else class_id
+
+    def build(row):
+        student = models.Student(school=school)
+        for key, value in row.items():
+            if isinstance(value, str):
+                value = normalize_text(value)
+            if value in (None, ''):
+                continue
+
+            if key in CLASS_COLUMNS:
+                class_key = get_column_key(value)
+                if class_key not in classes:
+                    raise ValueError(f"Unknown class '{value}'")
+                if classes[class_key] is None:
+                    raise ValueError(f"More than one class is named '{value}'")
+                student.classOfAdmission_id = classes[class_key]
+            elif key in fields:
+                field = fields[key]
+                try:
+                    setattr(student, field.attname, field.clean(value, student))
+                except DjangoValidationError as e:
+                    raise ValueError(f"{field.name}: {' '.join(e.messages)}")
+
+        if not student.studentFirstName:
+            raise ValueError("studentFirstName is required")
+        student.set_derived_fields()
+        return student
+
+    def index(students):
+        if students and students[0].pk is None:
+            # backends that can't return ids from a bulk insert
+            student_ids = dict(models.Student.objects.filter(
+                enrollmentId__in=[student.enrollmentId for student in students]
+            ).values_list('enrollmentId', 'id'))
+            for student in students:
+                student.pk = student_ids[student.enrollmentId]
+        index_students(students)
+
+    rows = (
+        (line, {get_column_key(column): value for column, value in row.items()})
+        for line, row in rows
+    )
+    return bulk_import(
+        models.Student, rows, build, ('studentfirstname',), batch_size,
+        on_created=index, known_columns={*fields, *CLASS_COLUMNS},
+    )
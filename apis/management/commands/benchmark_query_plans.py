@@ -0,0 +1,101 @@
+import time
+from datetime import date, datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from apis.models import Attendance, EmployeeAttendance, IncomeExpense, Receipt, School, Class
+from apis.utils import get_date_range
+
+
+class Command(BaseCommand):
+    help = "Show query plans and timings of the hot attendance/ledger queries before and after the composite indexes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--school', type=int, help="School id to benchmark (defaults to the first school)")
+        parser.add_argument('--date', type=str, help="Day to benchmark as YYYY-MM-DD (defaults to today)")
+        parser.add_argument('--runs', type=int, default=20, help="Executions per query when timing")
+
+    def handle(self, *args, **options):
+        school = School.objects.filter(id=options['school']).first() if options['school'] else School.objects.first()
+        if not school:
+            raise CommandError("No school found to benchmark.")
+
+        day = datetime.strptime(options['date'], '%Y-%m-%d').date() if options['date'] else date.today()
+        start, end = get_date_range(day.year, day.month)
+        class_id = Class.objects.filter(school=school).values_list('id', flat=True).first()
+
+        # (label, before queryset, after queryset, indexes that the after plan relies on)
+        hot_queries = [
+            (
+                "Daily class attendance sheet",
+                Attendance.objects.filter(date=day, student__classOfAdmission_id=class_id),
+                Attendance.objects.filter(date=day, student__classOfAdmission_id=class_id),
+                [(Attendance, 'attendance_date_student_idx')],
+            ),
+            (
+                "Monthly class attendance",
+                Attendance.objects.filter(student__classOfAdmission_id=class_id, date__year=day.year, date__month=day.month),
+                Attendance.objects.filter(student__classOfAdmission_id=class_id, date__gte=start, date__lt=end),
+                [(Attendance, 'attendance_date_student_idx')],
+            ),
+            (
+                "Monthly employee attendance",
+                EmployeeAttendance.objects.filter(employee__school=school, date__year=day.year, date__month=day.month),
+                EmployeeAttendance.objects.filter(employee__school=school, date__gte=start, date__lt=end),
+                [(EmployeeAttendance, 'empattendance_date_emp_idx')],
+            ),
+            (
+                "Income/expense ledger",
+                IncomeExpense.objects.filter(school=school).order_by('-date')[:50],
+                IncomeExpense.objects.filter(school=school).order_by('-date')[:50],
+                [(IncomeExpense, 'incomeexpense_school_date_idx')],
+            ),
+            (
+                "Latest receipts",
+                Receipt.objects.order_by('-receipt_date')[:50],
+                Receipt.objects.order_by('-receipt_date')[:50],
+                [(Receipt, 'receipt_date_idx')],
+            ),
+        ]
+
+        # the "before" plans need the indexes dropped and restored by a rollback,
+        # which only works where DDL is transactional (PostgreSQL, SQLite); MySQL
+        # commits DDL implicitly and would be left without its indexes
+        can_compare = connection.features.can_rollback_ddl
+        if not can_compare:
+            self.stdout.write(self.style.WARNING(
+                f"{connection.vendor} can't roll back DDL, only showing the plans with the indexes in place."
+            ))
+
+        for label, before, after, indexes in hot_queries:
+            self.stdout.write(self.style.MIGRATE_HEADING(label))
+
+            if can_compare:
+                # drop the indexes inside a transaction that is always rolled back
+                drop_statements = self.get_drop_statements(indexes)
+                with transaction.atomic():
+                    with connection.cursor() as cursor:
+                        for statement in drop_statements:
+                            cursor.execute(statement)
+                    self.report("before", before, options['runs'])
+                    transaction.set_rollback(True)
+
+            self.report("after", after, options['runs'])
+            self.stdout.write("")
+
+    def get_drop_statements(self, indexes):
+        with connection.schema_editor(collect_sql=True) as schema_editor:
+            for model, index_name in indexes:
+                index = next(index for index in model._meta.indexes if index.name == index_name)
+                schema_editor.remove_index(model, index)
+        return [statement.rstrip(';') for statement in schema_editor.collected_sql]
+
+    def report(self, label, queryset, runs):
+        plan = queryset.explain()
+        started = time.perf_counter()
+        for _ in range(runs):
+            list(queryset.all())
+        elapsed = (time.perf_counter() - started) / runs * 1000
+
+        self.stdout.write(f"  {label}: {elapsed:.2f} ms/query")
+        for line in plan.splitlines():
+            self.stdout.write(f"    {line}")
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from apis.models import Student
+from apis.search import get_search_keys, get_search_backend, index_students, SQLiteFTSSearchBackend
+
+
+class Command(BaseCommand):
+    help = "Fill the Student search keys and word tokens and build the configured search backend's index."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Students updated per bulk_update")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        students = Student.objects.only(
+            'id', 'school', 'enrollmentId', 'studentFirstName', 'studentMiddleName', 'studentLastName',
+            'fatherFirstName', 'fatherMiddleName', 'fatherLastName',
+            'search_name', 'search_name_father',
+        ).order_by('id')
+
+        updated = 0
+        indexed = 0
+        batch = []
+        with transaction.atomic():
+            for student in students.iterator(chunk_size=batch_size):
+                search_keys = get_search_keys(student)
+                if search_keys != (student.search_name, student.search_name_father):
+                    student.search_name, student.search_name_father = search_keys
+                    student.search_keys_changed = True
+                batch.append(student)
+                if len(batch) >= batch_size:
+                    updated += self.save_batch(batch)
+                    indexed += len(batch)
+                    batch = []
+            updated += self.save_batch(batch)
+            indexed += len(batch)
+
+        self.stdout.write(f"Updated search keys of {updated} students and re-indexed the words of {indexed}.")
+
+        backend = get_search_backend()
+        if isinstance(backend, SQLiteFTSSearchBackend):
+            backend.build()
+            self.stdout.write(f"Built the {backend.table} FTS5 index.")
+
+        self.stdout.write(self.style.SUCCESS("Student search index is ready!"))
+
+    def save_batch(self, students):
+        changed = [student for student in students if getattr(student, 'search_keys_changed', False)]
+        Student.objects.bulk_update(changed, ['search_name', 'search_name_father'])
+        index_students(students)
+        return len(changed)
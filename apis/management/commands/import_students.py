@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from apis.models import School
+from apis.imports import read_rows, import_students
+
+
+class Command(BaseCommand):
+    help = "Admit the students of a school from a CSV or XLSX file (Student field columns plus a class column)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or XLSX file")
+        parser.add_argument('--school', type=int, required=True, help="School id")
+        parser.add_argument('--batch-size', type=int, default=500, help="Students per bulk insert")
+
+    def handle(self, *args, **options):
+        school = School.objects.filter(id=options['school']).first()
+        if not school:
+            raise CommandError("School not found.")
+
+        with open(options['path'], 'rb') as file:
+            try:
+                created, errors = import_students(school, read_rows(file, options['path']), options['batch_size'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        if errors:
+            for error in errors:
+                self.stderr.write(f"line {error['line']}: {error['message']}")
+            raise CommandError("Nothing was imported.")
+
+        self.stdout.write(self.style.SUCCESS(f"Imported {created} students."))
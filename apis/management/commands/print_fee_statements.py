@@ -0,0 +1,32 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from apis.models import Student
+from apis.documents import get_statement_documents, render_documents
+
+
+class Command(BaseCommand):
+    help = "Render fee statement PDFs (e.g. year-end statements for a whole school) into a directory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Directory the PDFs are written to")
+        parser.add_argument('--school', type=int, required=True, help="School id")
+        parser.add_argument('--class', dest='class_id', type=int, help="Only students of this class id")
+        parser.add_argument('--date-from', help="First receipt date as YYYY-MM-DD")
+        parser.add_argument('--date-to', help="Last receipt date as YYYY-MM-DD")
+        parser.add_argument('--workers', type=int, help="Render processes (defaults to DOCUMENT_RENDER_WORKERS or the CPU count)")
+
+    def handle(self, *args, **options):
+        students = Student.objects.filter(school_id=options['school'])
+        if options['class_id']:
+            students = students.filter(classOfAdmission_id=options['class_id'])
+
+        documents = get_statement_documents(students, options['date_from'], options['date_to'])
+        if not documents:
+            raise CommandError("No students found.")
+
+        os.makedirs(options['output'], exist_ok=True)
+        for filename, pdf in render_documents(documents, workers=options['workers']):
+            with open(os.path.join(options['output'], filename), 'wb') as file:
+                file.write(pdf)
+
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(documents)} statements to {options['output']}."))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from apis.models import Exam, ExamResult, ObtainedMark
+from apis.utils import refresh_exam_results
+
+
+class Command(BaseCommand):
+    help = "Recompute the ExamResult snapshots from ObtainedMark."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--exam', type=int, help="Only rebuild this exam id")
+
+    def handle(self, *args, **options):
+        exams = Exam.objects.all()
+        if options['exam']:
+            exams = exams.filter(id=options['exam'])
+
+        for exam in exams:
+            student_ids = ObtainedMark.objects.filter(paper__exam=exam).values_list('student_id', flat=True).distinct()
+            ExamResult.objects.filter(exam=exam).exclude(student_id__in=student_ids).delete()
+            rebuilt = refresh_exam_results(exam.id, student_ids)
+            self.stdout.write(f"{exam.name}: {rebuilt} results")
+
+        self.stdout.write(self.style.SUCCESS("Exam results rebuilt successfully!"))
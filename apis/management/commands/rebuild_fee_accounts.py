@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from apis.models import Student
+from apis.utils import refresh_fee_accounts
+
+
+class Command(BaseCommand):
+    help = "Recompute every StudentFeeAccount from the receipts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--school', type=int, help="Only rebuild students of this school id")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Students refreshed per batch")
+
+    def handle(self, *args, **options):
+        students = Student.objects.order_by('id')
+        if options['school']:
+            students = students.filter(school_id=options['school'])
+
+        rebuilt = 0
+        batch = []
+        with transaction.atomic():
+            for student_id in students.values_list('id', flat=True).iterator(chunk_size=options['batch_size']):
+                batch.append(student_id)
+                if len(batch) >= options['batch_size']:
+                    rebuilt += refresh_fee_accounts(batch)
+                    batch = []
+            rebuilt += refresh_fee_accounts(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} fee accounts."))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from apis.models import Receipt, FeeCollection, Student
+from apis.utils import refresh_fee_collections
+
+
+class Command(BaseCommand):
+    help = "Recompute the FeeCollection rollups from the receipts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--school', type=int, help="Only rebuild this school id")
+        parser.add_argument('--batch-size', type=int, default=100, help="Days refreshed per batch")
+
+    def handle(self, *args, **options):
+        receipts = Receipt.objects.filter(receipt_date__isnull=False)
+        collections = FeeCollection.objects.all()
+        if options['school']:
+            receipts = receipts.filter(student__school_id=options['school'])
+            collections = collections.filter(school_id=options['school'])
+
+        school_days = receipts.values_list('student__school_id', 'receipt_date').distinct().order_by('student__school_id', 'receipt_date')
+
+        rebuilt = 0
+        batch = []
+        with transaction.atomic():
+            # receipts made before the class was stored on them keep the student's current class from now on
+            stamped = receipts.filter(class_name__isnull=True).update(
+                class_name=Subquery(Student.objects.filter(id=OuterRef('student_id')).values('classOfAdmission_id')[:1])
+            )
+
+            # rollups of days that no longer have receipts are dropped up front
+            collections.delete()
+            for school_day in school_days.iterator(chunk_size=options['batch_size']):
+                batch.append(school_day)
+                if len(batch) >= options['batch_size']:
+                    rebuilt += refresh_fee_collections(batch)
+                    batch = []
+            rebuilt += refresh_fee_collections(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Stored the class on {stamped} receipts and rebuilt fee collections for {rebuilt} days."))
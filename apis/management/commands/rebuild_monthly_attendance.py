@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from apis.models import Attendance, MonthlyAttendance
+from apis.utils import refresh_monthly_attendance, get_date_range
+
+
+class Command(BaseCommand):
+    help = "Rebuild the packed MonthlyAttendance rows from the Attendance table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--school', type=int, help="Only rebuild students of this school id")
+        parser.add_argument('--year', type=int, help="Only rebuild this year")
+        parser.add_argument('--month', type=int, help="Only rebuild this month (needs --year)")
+        parser.add_argument('--batch-size', type=int, default=2000, help="Student-months re-packed per batch")
+
+    def handle(self, *args, **options):
+        attendances = Attendance.objects.filter(date__isnull=False)
+        monthly_attendances = MonthlyAttendance.objects.all()
+
+        if options['school']:
+            attendances = attendances.filter(student__school_id=options['school'])
+            monthly_attendances = monthly_attendances.filter(student__school_id=options['school'])
+        if options['year']:
+            start, end = get_date_range(options['year'], options['month'])
+            attendances = attendances.filter(date__gte=start, date__lt=end)
+            monthly_attendances = monthly_attendances.filter(year=options['year'])
+            if options['month']:
+                monthly_attendances = monthly_attendances.filter(month=options['month'])
+
+        student_months = attendances.values_list('student_id', 'date__year', 'date__month').distinct()
+
+        with transaction.atomic():
+            deleted, _ = monthly_attendances.delete()
+
+            rebuilt = 0
+            batch = []
+            for student_month in student_months.iterator(chunk_size=options['batch_size']):
+                batch.append(student_month)
+                if len(batch) >= options['batch_size']:
+                    rebuilt += refresh_monthly_attendance(batch)
+                    batch = []
+            rebuilt += refresh_monthly_attendance(batch)
+
+        self.stdout.write(self.style.SUCCESS(f"Removed {deleted} and rebuilt {rebuilt} monthly attendance rows."))
@@ -1,5 +1,7 @@
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
 import uuid
 from datetime import datetime
 
@@ -261,13 +263,20 @@ class Student(models.Model):
     father_full_name = models.CharField(max_length=200, null=True, blank=True)
     student_father_combined_name = models.CharField(max_length=400, null=True, blank=True)
     photo = models.ImageField(upload_to='student_photos', null=True, blank=True)
+    # normalized, lower-cased copies of the names used by apis.search
+    search_name = models.CharField(max_length=200, null=True, blank=True, editable=False)
+    search_name_father = models.CharField(max_length=400, null=True, blank=True, editable=False)
 
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['school', 'studentFirstName', 'id'], name='student_school_first_name_idx'),
+        ]
 
-    def save(self, *args, **kwargs):
-     
 
 
+    def set_derived_fields(self):
+        """Fill enrollmentId, the full names and the search keys; also needed before bulk_create, which skips save()."""
         if not self.enrollmentId:
             # Generate a unique enrollmentId based on UUID
             self.enrollmentId = f'ENR-{uuid.uuid4().hex[:10].upper()}'
@@ -275,14 +284,30 @@ class Student(models.Model):
         self.student_full_name = f"{self.studentFirstName} {self.studentMiddleName} {self.studentLastName}"
         self.father_full_name = f"{self.fatherFirstName} {self.fatherMiddleName} {self.fatherLastName}"
         self.student_father_combined_name = f"{self.student_full_name} {self.father_full_name}"
-        
-        super(Student, self).save(*args, **kwargs)
+
+        from .search import get_search_keys
+        self.search_name, self.search_name_father = get_search_keys(self)
+
+
+    def save(self, *args, **kwargs):
+        self.set_derived_fields()
+        from .search import index_students
+        with transaction.atomic():
+            super(Student, self).save(*args, **kwargs)
+            index_students([self])
 
 
     def delete(self, *args, **kwargs):
+        from .utils import rerank_exam_results
         if self.photo:
             self.photo.delete()
-        super().delete(*args, **kwargs)
+        # the student's results go with them, so the classes they were ranked in close the gap
+        exam_classes = list(self.exam_results.exclude(class_name=None).values_list('exam_id', 'class_name_id'))
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            for exam_id, class_id in exam_classes:
+                rerank_exam_results(exam_id, [class_id])
+        return result
         
 
     def __str__(self) -> str:
@@ -294,6 +319,29 @@ class Student(models.Model):
 
 
 
+class StudentSearchToken(models.Model):
+    """
+    Word-prefix index of the student search keys, maintained by apis.search.
+    Every word of a key gets a row holding the key from that word on, so both
+    "anna" and "maria" find "anna maria khan" with one range scan of
+    (school, field, token).
+    """
+    school = models.ForeignKey(School, on_delete=models.CASCADE, related_name='student_search_tokens')
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='search_tokens')
+    field = models.CharField(max_length=20)
+    token = models.CharField(max_length=400)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['school', 'field', 'token'], name='studentsearchtoken_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.student_id} {self.field} -> {self.token}"
+
+
+
+
 class ClassSubject(models.Model):
     class_name = models.ForeignKey(Class, on_delete=models.CASCADE, related_name='class_subjects')
     subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='class_subjects')
@@ -342,6 +390,11 @@ class IncomeExpense(models.Model):
     particulars = models.CharField(max_length=200, null=True, blank=True)
     amount = models.DecimalField(max_digits=50, decimal_places=2, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['school', '-date'], name='incomeexpense_school_date_idx'),
+        ]
+
 
     def __str__(self) -> str:
         return f"{self.head.head} -> {self.school}"
@@ -403,6 +456,51 @@ class ObtainedMark(models.Model):
 
 
 
+GRADE_SCALE = [
+    (90, 'A+'),
+    (80, 'A'),
+    (70, 'B+'),
+    (60, 'B'),
+    (50, 'C+'),
+    (40, 'C'),
+    (35, 'D'),
+    (0, 'NG'),
+]
+
+class ExamResult(models.Model):
+    """Snapshot of a student's result in an exam, refreshed whenever their marks change."""
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='exam_results')
+    exam = models.ForeignKey(Exam, on_delete=models.CASCADE, related_name='exam_results')
+    class_name = models.ForeignKey(Class, on_delete=models.CASCADE, related_name='exam_results', null=True)
+    total = models.IntegerField(default=0)
+    full_marks = models.IntegerField(default=0)
+    percentage = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    failed_papers = models.PositiveSmallIntegerField(default=0)
+    grade = models.CharField(max_length=5, null=True, blank=True)
+    class_rank = models.PositiveIntegerField(null=True, blank=True)
+
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+
+    class Meta:
+        unique_together = ('student', 'exam')
+        indexes = [
+            models.Index(fields=['exam', 'class_name', '-total'], name='examresult_exam_class_idx'),
+        ]
+
+    @staticmethod
+    def get_grade(percentage):
+        if percentage is None:
+            return None
+        return next(grade for minimum, grade in GRADE_SCALE if percentage >= minimum)
+
+    def __str__(self) -> str:
+        return f"{self.student} -> {self.exam.name}"
+
+
+
+
+
+
 class Month(models.Model):
     name = models.CharField(max_length=50, null=True, blank=True, unique=True)
 
@@ -412,9 +510,39 @@ class Month(models.Model):
 
 
 
+class ReceiptSequence(models.Model):
+    """Per-school, per-day counter handing out receipt serials."""
+    school = models.ForeignKey(School, on_delete=models.CASCADE, related_name='receipt_sequences')
+    date = models.DateField()
+    last_value = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('school', 'date')
+
+    @classmethod
+    def next_values(cls, school, date, count=1):
+        """
+        Atomically advance the counter by `count` and return the first serial of
+        the reserved block. The UPDATE locks the row until the surrounding
+        transaction ends, so concurrent callers never get the same serials.
+        """
+        with transaction.atomic():
+            cls.objects.bulk_create([cls(school=school, date=date)], ignore_conflicts=True)
+            cls.objects.filter(school=school, date=date).update(last_value=F('last_value') + count)
+            last_value = cls.objects.filter(school=school, date=date).values_list('last_value', flat=True).get()
+        return last_value - count + 1
+
+    def __str__(self) -> str:
+        return f"{self.school} -> {self.date}: {self.last_value}"
+
+
+
+
 class Receipt(models.Model):
     receipt_no = models.CharField(max_length=50, null=True, blank=True, unique=True)
     student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='receipts')
+    # the student's class when the receipt was made, so promotions don't move past collections
+    class_name = models.ForeignKey(Class, on_delete=models.SET_NULL, related_name='receipts', null=True, blank=True)
     receipt_date = models.DateField(null=True, blank=True)
     months = models.ManyToManyField(Month, related_name='receipts',  blank=True)
     admission_fees = models.DecimalField(null=True, blank=True, max_digits=20, decimal_places=2)
@@ -440,17 +568,30 @@ class Receipt(models.Model):
 
 
     created_at = models.DateTimeField(auto_now_add=True, null=True)
-    #auto generate receipt no serially, follow this pattern, like REC-Date-Serial
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-receipt_date'], name='receipt_date_idx'),
+        ]
+
+    #receipt no follows the pattern REC<Date>-<School>-<Serial>, the serial restarts every day per school
+    @staticmethod
+    def format_receipt_no(school_id, date, serial):
+        return f"REC{date:%Y%m%d}-{school_id}-{serial}"
+
+    @classmethod
+    def get_new_receipt_no(cls, school, date=None):
+        """Preview the next receipt number without reserving it."""
+        date = date or timezone.localdate()
+        last_value = ReceiptSequence.objects.filter(school=school, date=date).values_list('last_value', flat=True).first() or 0
+        return cls.format_receipt_no(school.id, date, last_value + 1)
+
     @classmethod
-    def get_new_receipt_no(cls, *args, **kwargs):
-        date = datetime.now().strftime("%Y-%m-%d")
-        serial = cls.objects.count() + 1
-        receipt_no = f"REC{date}{serial}".replace('-', '')
-        # print(receipt_no)
-        while cls.objects.filter(receipt_no=receipt_no).exists():
-            serial += 1
-            receipt_no = f"REC{date}{serial}".replace('-', '')
-        return receipt_no
+    def allocate_receipt_nos(cls, school, count=1, date=None):
+        """Reserve `count` consecutive receipt numbers; call inside the transaction that uses them."""
+        date = date or timezone.localdate()
+        first_serial = ReceiptSequence.next_values(school, date, count)
+        return [cls.format_receipt_no(school.id, date, serial) for serial in range(first_serial, first_serial + count)]
 
 
     def __str__(self) -> str:
@@ -458,6 +599,72 @@ class Receipt(models.Model):
 
 
 
+class ReceiptSettlement(models.Model):
+    """
+    Dues of an older receipt cleared by a later receipt's deposit. The later
+    receipt keeps the full cash received in deposit_fees; these rows record
+    what part of it went to older dues so it can be put back.
+    """
+    receipt = models.ForeignKey(Receipt, on_delete=models.CASCADE, related_name='settlements')
+    settled_receipt = models.ForeignKey(Receipt, on_delete=models.CASCADE, related_name='settled_by')
+    amount = models.DecimalField(max_digits=20, decimal_places=2)
+
+    created_at = models.DateTimeField(auto_now_add=True, null=True)
+
+    def __str__(self) -> str:
+        return f"{self.receipt} settled {self.amount} of {self.settled_receipt}"
+
+
+
+class StudentFeeAccount(models.Model):
+    """
+    Running fee position of a student, derived from their receipts: the sum of
+    remaining_fees and the months paid so far. Refreshed on every receipt
+    insert/delete; `rebuild_fee_accounts` regenerates it from scratch.
+    """
+    student = models.OneToOneField(Student, on_delete=models.CASCADE, related_name='fee_account')
+    outstanding_fees = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    paid_months = models.JSONField(default=list, blank=True)  # [{'id': ..., 'name': ...}] ordered by month id
+
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+
+    def __str__(self) -> str:
+        return f"{self.student} -> {self.outstanding_fees}"
+
+
+
+class FeeCollection(models.Model):
+    """
+    Daily fee collection rollup per (school, day, payment mode, class) built
+    from the dated receipts; the class is the one stored on the receipt when it
+    was made (the student's current class for older receipts without one). Days are
+    recomputed whenever one of their receipts is created or deleted and
+    `rebuild_fee_collections` regenerates the table from scratch.
+    """
+    school = models.ForeignKey(School, on_delete=models.CASCADE, related_name='fee_collections')
+    date = models.DateField()
+    payment_mode = models.CharField(max_length=50, blank=True, default='')
+    class_name = models.ForeignKey(Class, on_delete=models.CASCADE, related_name='fee_collections', null=True, blank=True)
+
+    receipt_count = models.PositiveIntegerField(default=0)
+    deposit_fees = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    concession_amount = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    net_fees = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            # rows without a class are kept unique by the per-day lock in refresh_fee_collections
+            models.UniqueConstraint(fields=['school', 'date', 'payment_mode', 'class_name'], name='feecollection_unique_group'),
+        ]
+        indexes = [
+            models.Index(fields=['school', 'date'], name='feecollection_school_date_idx'),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.school} {self.date} {self.payment_mode or '-'} -> {self.deposit_fees}"
+
+
+
 ATTENDANCE_STATUS = [
     ('P', 'Present'),
     ('A', 'Absent'),
@@ -472,6 +679,24 @@ class Attendance(models.Model):
 
     class Meta:
         unique_together = ('student', 'date')
+        indexes = [
+            # daily sheets and month ranges filter on date first, then join the class
+            models.Index(fields=['date', 'student'], name='attendance_date_student_idx'),
+        ]
+
+    # single-row writes (admin, shell) keep the packed MonthlyAttendance in step too
+    def save(self, *args, **kwargs):
+        from .utils import refresh_attendance_months
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            refresh_attendance_months([(self.student_id, self.date)])
+
+    def delete(self, *args, **kwargs):
+        from .utils import refresh_attendance_months
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            refresh_attendance_months([(self.student_id, self.date)])
+        return result
 
     def __str__(self) -> str:
         return f"{self.student} -> {self.date}"
@@ -487,6 +712,9 @@ class EmployeeAttendance(models.Model):
 
     class Meta:
         unique_together = ('employee', 'date')
+        indexes = [
+            models.Index(fields=['date', 'employee'], name='empattendance_date_emp_idx'),
+        ]
 
     def __str__(self) -> str:
         return f"{self.employee} -> {self.date}"
@@ -494,3 +722,63 @@ class EmployeeAttendance(models.Model):
 
 
 
+
+
+
+class MonthlyAttendance(models.Model):
+    """
+    Packed copy of a student's Attendance rows for one month. Every day takes two
+    bits of `packed_statuses` (day 1 in the lowest bits), so a whole month fits
+    in one BigIntegerField. Attendance stays the source of truth; these rows are
+    refreshed on write and can be rebuilt with `rebuild_monthly_attendance`.
+    """
+    STATUS_CODES = {'P': 1, 'A': 2, 'L': 3}
+    UNMARKED = '-'
+
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='monthly_attendances')
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    packed_statuses = models.BigIntegerField(default=0)
+    total_present = models.PositiveSmallIntegerField(default=0)
+    total_absent = models.PositiveSmallIntegerField(default=0)
+    total_leave = models.PositiveSmallIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+
+    class Meta:
+        unique_together = ('student', 'year', 'month')
+
+    @classmethod
+    def pack(cls, day_statuses):
+        """Pack a {day: status} mapping into the two-bits-per-day integer."""
+        packed = 0
+        for day, attendance_status in day_statuses.items():
+            code = cls.STATUS_CODES.get(attendance_status)
+            if code:
+                packed |= code << ((day - 1) * 2)
+        return packed
+
+    @classmethod
+    def unpack(cls, packed, days_in_month):
+        """Turn the packed integer back into a one-character-per-day status string."""
+        letters = {code: letter for letter, code in cls.STATUS_CODES.items()}
+        return ''.join(
+            letters.get((packed >> (day * 2)) & 0b11, cls.UNMARKED)
+            for day in range(days_in_month)
+        )
+
+    @classmethod
+    def from_day_statuses(cls, student_id, year, month, day_statuses):
+        statuses = list(day_statuses.values())
+        return cls(
+            student_id=student_id,
+            year=year,
+            month=month,
+            packed_statuses=cls.pack(day_statuses),
+            total_present=statuses.count('P'),
+            total_absent=statuses.count('A'),
+            total_leave=statuses.count('L'),
+        )
+
+    def __str__(self) -> str:
+        return f"{self.student} -> {self.year}-{self.month:02d}"
@@ -0,0 +1,250 @@
+"""
+School-scoped student search.
+
+Every backend answers `search(school, students, field, term, limit)` with the
+matching students of `students` (which belong to `school`) ordered best first
+(exact match, then prefix, then word prefix). The backend is picked with the
+STUDENT_SEARCH_BACKEND setting:
+
+    'prefix'   indexed range scans over StudentSearchToken (default, any database)
+    'fts5'     SQLite FTS5 table kept in sync by triggers (see build_student_search_index)
+    'trigram'  PostgreSQL pg_trgm similarity, tolerant to typos
+"""
+import unicodedata
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, When, Value, IntegerField
+from . import models
+from .utils import normalize_text
+
+
+SEARCH_FIELDS = {
+    'name': 'search_name',
+    'name_father': 'search_name_father',
+    'enrollment_id': 'enrollmentId',
+}
+
+ENROLLMENT_PREFIX = 'ENR-'
+
+# longer keys only need their beginning indexed, and the hex token must fit its column
+TOKEN_BYTES = 190
+
+
+def fold_accents(text):
+    """Drop the Latin diacritics ("Élodie" -> "Elodie"), other scripts are left alone."""
+    decomposed = unicodedata.normalize('NFD', text)
+    return unicodedata.normalize('NFC', ''.join(char for char in decomposed if not '\u0300' <= char <= '\u036f'))
+
+
+def make_search_key(*parts):
+    """Join the non-empty name parts and normalize them into a lower-cased, accent-folded search key."""
+    text = ' '.join(str(part) for part in parts if part)
+    return fold_accents(normalize_text(text)).casefold() or None
+
+
+def get_search_keys(student):
+    """Return (search_name, search_name_father) for a Student instance."""
+    search_name = make_search_key(student.studentFirstName, student.studentMiddleName, student.studentLastName)
+    father_name = make_search_key(student.fatherFirstName, student.fatherMiddleName, student.fatherLastName)
+    return search_name, make_search_key(search_name, father_name)
+
+
+def normalize_term(field, term):
+    if field == 'enrollment_id':
+        term = normalize_text(term).upper()
+        return term if term.startswith(ENROLLMENT_PREFIX) else ENROLLMENT_PREFIX + term
+    return make_search_key(term)
+
+
+def encode_token(text):
+    """
+    Hex of the UTF-8 bytes of `text`, cut to TOKEN_BYTES. Hex digits sort the
+    same under every collation, and a text prefix is a token prefix, so prefix
+    searches become plain range scans whatever the database collation is.
+    """
+    data = text.encode()[:TOKEN_BYTES].decode(errors='ignore').encode()
+    return data.hex()
+
+
+def get_token_range(key):
+    """[start, end) token range of the keys starting with `key`."""
+    data = bytes.fromhex(encode_token(key))
+    # UTF-8 never contains 0xff, so the last byte can always be bumped
+    return data.hex(), (data[:-1] + bytes([data[-1] + 1])).hex()
+
+
+def get_search_tokens(student):
+    """{(field, token)} of a Student: the name keys from each word on, and the enrollment id."""
+    tokens = set()
+    for field in ('name', 'name_father'):
+        key = getattr(student, SEARCH_FIELDS[field])
+        if key:
+            words = key.split(' ')
+            tokens.update((field, encode_token(' '.join(words[position:]))) for position in range(len(words)))
+    if student.enrollmentId:
+        tokens.add(('enrollment_id', encode_token(student.enrollmentId)))
+    return tokens
+
+
+def index_students(students, batch_size=1000):
+    """Replace the StudentSearchToken rows of saved Student instances: one delete and one insert."""
+    students = [student for student in students if student.pk]
+    if not students:
+        return 0
+
+    with transaction.atomic():
+        models.StudentSearchToken.objects.filter(student__in=students).delete()
+        models.StudentSearchToken.objects.bulk_create(
+            [
+                models.StudentSearchToken(school_id=student.school_id, student_id=student.pk, field=field, token=token)
+                for student in students
+                for field, token in get_search_tokens(student)
+            ],
+            batch_size=batch_size,
+        )
+    return len(students)
+
+
+class PrefixSearchBackend:
+    """Exact, prefix and word-prefix matches from one range scan of the (school, field, token) index."""
+
+    def search(self, school, students, field, term, limit=10):
+        column = SEARCH_FIELDS[field]
+        key = normalize_term(field, term)
+        if not key:
+            return []
+
+        start, end = get_token_range(key)
+        matching_ids = models.StudentSearchToken.objects.filter(
+            school=school, field=field, token__gte=start, token__lt=end
+        ).values('student_id')
+
+        return list(
+            students.filter(id__in=matching_ids).annotate(
+                search_rank=Case(
+                    When(**{column: key}, then=Value(0)),
+                    When(**{f'{column}__startswith': key}, then=Value(1)),
+                    default=Value(2),
+                    output_field=IntegerField(),
+                )
+            ).order_by('search_rank', column, 'id')[:limit]
+        )
+
+
+class SQLiteFTSSearchBackend(PrefixSearchBackend):
+    """SQLite FTS5 index over the search keys, ranked with bm25."""
+
+    table = 'apis_student_search'
+
+    def is_available(self):
+        return connection.vendor == 'sqlite' and self.table in connection.introspection.table_names()
+
+    def search(self, school, students, field, term, limit=10):
+        if field == 'enrollment_id' or not self.is_available():
+            return super().search(school, students, field, term, limit)
+
+        key = make_search_key(term)
+        if not key:
+            return []
+
+        column = SEARCH_FIELDS[field]
+        # every word becomes a quoted prefix query on the chosen column
+        query = ' '.join('"{}"*'.format(word.replace('"', '""')) for word in key.split())
+        students_sql, students_params = students.values('id').query.sql_with_params()
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s "
+                f"AND rowid IN ({students_sql}) ORDER BY bm25({self.table}) LIMIT %s",
+                [f'{{{column}}} : ({query})', *students_params, limit],
+            )
+            ranked_ids = [row[0] for row in cursor.fetchall()]
+
+        found = students.in_bulk(ranked_ids)
+        results = []
+        for search_rank, student_id in enumerate(ranked_ids):
+            student = found[student_id]
+            student.search_rank = search_rank
+            results.append(student)
+        return results
+
+    def build(self):
+        """(Re)create the FTS5 table with the triggers that keep it in sync with apis_student."""
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE {self.table} USING fts5("
+                f"search_name, search_name_father, content='apis_student', content_rowid='id')"
+            )
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {self.table}_ai AFTER INSERT ON apis_student BEGIN
+                    INSERT INTO {self.table}(rowid, search_name, search_name_father)
+                    VALUES (new.id, new.search_name, new.search_name_father);
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {self.table}_ad AFTER DELETE ON apis_student BEGIN
+                    INSERT INTO {self.table}({self.table}, rowid, search_name, search_name_father)
+                    VALUES ('delete', old.id, old.search_name, old.search_name_father);
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {self.table}_au AFTER UPDATE OF search_name, search_name_father ON apis_student BEGIN
+                    INSERT INTO {self.table}({self.table}, rowid, search_name, search_name_father)
+                    VALUES ('delete', old.id, old.search_name, old.search_name_father);
+                    INSERT INTO {self.table}(rowid, search_name, search_name_father)
+                    VALUES (new.id, new.search_name, new.search_name_father);
+                END
+            """)
+            cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('rebuild')")
+
+
+class TrigramSearchBackend(PrefixSearchBackend):
+    """PostgreSQL pg_trgm similarity; needs the pg_trgm extension and a GIN trigram index."""
+
+    threshold = 0.3
+
+    def search(self, school, students, field, term, limit=10):
+        if field == 'enrollment_id' or connection.vendor != 'postgresql':
+            return super().search(school, students, field, term, limit)
+
+        from django.contrib.postgres.search import TrigramWordSimilarity
+
+        key = make_search_key(term)
+        if not key:
+            return []
+
+        column = SEARCH_FIELDS[field]
+        results = list(
+            students.annotate(
+                similarity=TrigramWordSimilarity(key, column)
+            ).filter(similarity__gte=self.threshold).order_by('-similarity', column, 'id')[:limit]
+        )
+        for search_rank, student in enumerate(results):
+            student.search_rank = search_rank
+        return results
+
+
+SEARCH_BACKENDS = {
+    'prefix': PrefixSearchBackend,
+    'fts5': SQLiteFTSSearchBackend,
+    'trigram': TrigramSearchBackend,
+}
+
+
+def get_search_backend():
+    return SEARCH_BACKENDS[getattr(settings, 'STUDENT_SEARCH_BACKEND', 'prefix')]()
+
+
+def search_students(school, field, term, limit=10, students=None):
+    """
+    Ranked students of `school` matching `term` on `field` ('name',
+    'name_father' or 'enrollment_id'); `students` narrows or decorates the
+    school's student queryset.
+    """
+    if field not in SEARCH_FIELDS:
+        field = 'enrollment_id'
+    if students is None:
+        students = models.Student.objects.all()
+    return get_search_backend().search(school, students.filter(school=school), field, term, limit)
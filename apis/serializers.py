@@ -4,7 +4,8 @@ from PIL import Image
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework.response import Response
 from rest_framework import status
-from .utils import reconfigure_rollNo
+from django.db import transaction
+from .utils import refresh_student_exam_results, get_student_exams
 
 
 
@@ -128,7 +129,15 @@ class StudentSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Student
-        fields = ['id', 'classOfAdmission'] + [field.name for field in Student._meta.fields if field.name not in ['id', 'classOfAdmission']]
+        fields = ['id', 'classOfAdmission'] + [field.name for field in Student._meta.fields if field.name not in ['id', 'classOfAdmission', 'search_name', 'search_name_father']]
+
+
+    def __init__(self, *args, fields=None, **kwargs):
+        # optional sparse fieldset, e.g. StudentSerializer(students, many=True, fields=['id', 'rollNo'])
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields) - {'id'}:
+                self.fields.pop(field_name)
 
 
 
@@ -148,8 +157,13 @@ class StudentSerializer(serializers.ModelSerializer):
 
 
     def update(self, instance, validated_data):
-        # You can include custom logic here for updates if needed
-        return super().update(instance, validated_data)
+        # a class change carries the student's exam results over to the new class
+        old_class_id = instance.classOfAdmission_id
+        with transaction.atomic():
+            instance = super().update(instance, validated_data)
+            if instance.classOfAdmission_id != old_class_id:
+                refresh_student_exam_results(get_student_exams([instance.id]))
+        return instance
 
 
     # def save(self, *args, **kwargs):
@@ -446,6 +460,8 @@ class StudentUpdateSerializer(serializers.ModelSerializer):
         ]
 
     def update(self, instance, validated_data):
+        old_class_id = instance.classOfAdmission_id
+
         # Handle nested fields and update logic for fields
         class_of_admission = validated_data.pop('classOfAdmission', None)
         if class_of_admission:
@@ -463,7 +479,11 @@ class StudentUpdateSerializer(serializers.ModelSerializer):
         for field, value in validated_data.items():
             setattr(instance, field, value)
 
-        instance.save()
+        with transaction.atomic():
+            instance.save()
+            # a class change carries the student's exam results over to the new class
+            if instance.classOfAdmission_id != old_class_id:
+                refresh_student_exam_results(get_student_exams([instance.id]))
         return instance
 
 
@@ -1,3 +1,126 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, override_settings
+
+from . import documents
+
+
+def make_receipt_document(receipt_no):
+    return {
+        'kind': 'receipt',
+        'filename': f"{receipt_no}.pdf",
+        'letterhead': {'name': 'Test School', 'tag_line': '', 'address': 'Main Road', 'phone': '', 'photo': None},
+        'receipt_no': receipt_no,
+        'date': '2026-04-01',
+        'student': {'name': 'Anna Khan', 'father_name': 'Omar Khan', 'enrollment_id': 'ENR-TEST', 'class_name': 'One', 'roll_no': 1},
+        'months': ['April'],
+        'items': [('Monthly Fees', '500.00')],
+        'totals': [('Total', '500.00'), ('Deposited', '500.00'), ('Remaining', '0.00')],
+        'payment_mode': 'cash',
+        'remarks': '',
+    }
+
+
+class RenderDocumentsTests(SimpleTestCase):
+    """Batch PDF rendering and its cache; everything runs offline against a temporary cache directory."""
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        settings_override = override_settings(DOCUMENT_CACHE_DIR=self.cache_dir, DOCUMENT_CACHE_MAX_SIZE=None)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def cached_files(self):
+        return sorted(name for name in os.listdir(self.cache_dir) if name.endswith('.pdf'))
+
+    def test_cache_miss_renders_and_stores(self):
+        rendered = documents.render_documents([make_receipt_document('REC-1')], workers=0)
+
+        self.assertEqual(rendered[0][0], 'REC-1.pdf')
+        self.assertTrue(rendered[0][1].startswith(b'%PDF'))
+        self.assertEqual(len(self.cached_files()), 1)
+
+    def test_cache_hit_skips_rendering(self):
+        document = make_receipt_document('REC-1')
+        first = documents.render_documents([document], workers=0)
+
+        with mock.patch.object(documents, 'render_document') as render_document:
+            second = documents.render_documents([document], workers=0)
+
+        render_document.assert_not_called()
+        self.assertEqual(first, second)
+
+    def test_changed_document_misses_the_cache(self):
+        document = make_receipt_document('REC-1')
+        documents.render_documents([document], workers=0)
+
+        document['totals'] = [('Total', '600.00')]
+        with mock.patch.object(documents, 'render_document', wraps=documents.render_document) as render_document:
+            documents.render_documents([document], workers=0)
+
+        render_document.assert_called_once()
+        self.assertEqual(len(self.cached_files()), 2)
+
+    def test_duplicate_documents_render_once(self):
+        document = make_receipt_document('REC-1')
+        with mock.patch.object(documents, 'render_document', wraps=documents.render_document) as render_document:
+            rendered = documents.render_documents([document, document], workers=0)
+
+        render_document.assert_called_once()
+        self.assertEqual(rendered[0], rendered[1])
+
+    def test_workers_zero_renders_in_process(self):
+        batch = [make_receipt_document(f'REC-{number}') for number in range(documents.INLINE_RENDER_LIMIT + 2)]
+
+        with mock.patch.object(documents, 'get_render_pool') as get_render_pool:
+            rendered = documents.render_documents(batch, workers=0)
+
+        get_render_pool.assert_not_called()
+        self.assertEqual([filename for filename, _ in rendered], [document['filename'] for document in batch])
+
+    def test_small_batches_render_in_process(self):
+        batch = [make_receipt_document(f'REC-{number}') for number in range(documents.INLINE_RENDER_LIMIT)]
+
+        with mock.patch.object(documents, 'get_render_pool') as get_render_pool:
+            documents.render_documents(batch, workers=4)
+
+        get_render_pool.assert_not_called()
+
+    def test_large_batches_use_the_shared_pool(self):
+        batch = [make_receipt_document(f'REC-{number}') for number in range(documents.INLINE_RENDER_LIMIT + 1)]
+        pool = mock.Mock()
+        pool.map.side_effect = lambda render, pending, chunksize: [render(document) for document in pending]
+
+        with mock.patch.object(documents, 'get_render_pool', return_value=pool) as get_render_pool:
+            rendered = documents.render_documents(batch, workers=2)
+
+        get_render_pool.assert_called_once_with(2)
+        self.assertEqual(len(rendered), len(batch))
+        self.assertEqual(len(self.cached_files()), len(batch))
+
+    def test_cache_is_pruned_oldest_first(self):
+        first = make_receipt_document('REC-1')
+        documents.render_documents([first], workers=0)
+        size = os.path.getsize(os.path.join(self.cache_dir, self.cached_files()[0]))
+        os.utime(os.path.join(self.cache_dir, self.cached_files()[0]), (1, 1))
+
+        with override_settings(DOCUMENT_CACHE_MAX_SIZE=size * 3 // 2):
+            documents.render_documents([make_receipt_document('REC-2')], workers=0)
+
+        self.assertEqual(len(self.cached_files()), 1)
+        with mock.patch.object(documents, 'render_document', wraps=documents.render_document) as render_document:
+            documents.render_documents([first], workers=0)
+        render_document.assert_called_once()
+
+    def test_bundle_documents_zips_every_pdf(self):
+        rendered = documents.render_documents([make_receipt_document('REC-1'), make_receipt_document('REC-2')], workers=0)
+
+        with zipfile.ZipFile(io.BytesIO(documents.bundle_documents(rendered))) as archive:
+            self.assertEqual(archive.namelist(), ['REC-1.pdf', 'REC-2.pdf'])
+            self.assertEqual(archive.read('REC-2.pdf'), rendered[1][1])
@@ -43,9 +43,11 @@ urlpatterns = [
 
 
     #students
+    path('students/import/', import_student, name='import_student'),
     path('students/promote/', promote_student, name='promote_student'),
     path('students/<int:id>/update/', UpdateStudentView.as_view(), name='update_student'),
     path('students/roll_no/update/', configure_rollNo, name='configure_rollNo'),
+    path('students/roll_no/renumber/', renumber_rollNo, name='renumber_rollNo'),
     
     
     
@@ -74,6 +76,9 @@ urlpatterns = [
     path('get_expense_heads/', get_expense_heads, name='get_expense_heads'),
     path('add_income_expense/', add_income_expense, name='add_income_expense'),
     path('get_income_expenses/', get_income_expenses, name='get_income_expenses'),
+    path('get_income_expense_ledger/', get_income_expense_ledger, name='get_income_expense_ledger'),
+    path('get_income_expense_summary/', get_income_expense_summary, name='get_income_expense_summary'),
+    path('import_income_expense/', import_income_expense, name='import_income_expense'),
     path('delete_income_expense/<int:id>/', delete_income_expense, name='delete_income_expense'),
 
 
@@ -97,12 +102,16 @@ urlpatterns = [
     #students
     path('get_students_for_marks_entry/<int:exam_id>/<int:class_id>/', get_students_for_marks_entry, name="get_students_for_marks_entry"),
     path('update_marks/', update_marks, name="update_marks"),
+    path('update_class_marks/', update_class_marks, name="update_class_marks"),
     path('get_student_by_enr_no/<int:exam_id>/<enr_no>/', get_student_by_enr_no, name="get_student_by_enr_no"),
 
 
     #result
     path('get_student_report/<int:exam_id>/<search_key>/<filter>/', get_student_report, name="get_student_report"),
+    path('search_students/<str:filter>/<str:search_key>/', get_student_search, name="get_student_search"),
     path('get_marks/<int:exam_id>/<int:class_id>/', get_marks, name="get_marks"),
+    path('get_results/<int:exam_id>/', get_results, name="get_results"),
+    path('get_results/<int:exam_id>/<int:class_id>/', get_results, name="get_class_results"),
 
 
 
@@ -111,8 +120,16 @@ urlpatterns = [
     path('get_new_receipt_no/', get_new_receipt_no, name="get_new_receipt_no"),
     path('get_student_for_receipt/<enr_no>/', get_student_for_receipt, name="get_student_for_receipt"),
     path('create_receipt/', create_receipt, name="create_receipt"),
+    path('create_receipts/', create_receipts, name="create_receipts"),
     path('get_receipts/', get_receipts, name="get_receipts"),
     path('delete_receipt/', delete_receipt, name="delete_receipt"),
+    path('fee_dues/', get_fee_dues_report, name="get_fee_dues_report"),
+    path('fee_dues/<int:class_id>/', get_fee_dues_report, name="get_class_fee_dues_report"),
+    path('fee_collection_summary/', get_fee_collection_summary, name="get_fee_collection_summary"),
+    path('get_receipt_pdf/<int:receipt_id>/', get_receipt_pdf, name="get_receipt_pdf"),
+    path('print_receipts/', print_receipts, name="print_receipts"),
+    path('get_fee_statement_pdf/<int:student_id>/', get_fee_statement_pdf, name="get_fee_statement_pdf"),
+    path('print_fee_statements/', print_fee_statements, name="print_fee_statements"),
 
 
 
@@ -125,7 +142,14 @@ urlpatterns = [
     path('get_employees_for_attendance/<str:date>/', get_employees_for_attendance, name="get_employees_for_attendance"),
     path('update_employee_attendance/', update_employee_attendance, name="update_employee_attendance"),
     path('get_employee_attendance_by_month/<int:year>/<int:month>/', get_employee_attendance_by_month, name="get_employee_attendance_by_month"),
-    path('get_employee_attendance_by_month_search_term/<int:year>/<int:month>/<str:search_type>/<str:search_term>/', get_employee_attendance_by_month_search_term, name="get_employee_attendance_by_month_search_term")
+    path('get_employee_attendance_by_month_search_term/<int:year>/<int:month>/<str:search_type>/<str:search_term>/', get_employee_attendance_by_month_search_term, name="get_employee_attendance_by_month_search_term"),
+
+    #exports
+    path('export_students/', export_students, name="export_students"),
+    path('export_employees/', export_employees, name="export_employees"),
+    path('export_attendance_register/<int:year>/<int:month>/', export_attendance_register, name="export_attendance_register"),
+    path('export_employee_attendance_register/<int:year>/<int:month>/', export_employee_attendance_register, name="export_employee_attendance_register"),
+    path('export_marks/<int:exam_id>/<int:class_id>/', export_marks, name="export_marks"),
 
 
 ]
@@ -1,4 +1,5 @@
-from django.db.models import F
+from django.db.models import F, Case, When, Exists, OuterRef, Subquery, Value, Count, Q, Sum, Window, FloatField, Aggregate, CharField, DecimalField, ExpressionWrapper
+from django.db.models.functions import Coalesce, Cast, NullIf, Rank, RowNumber
 from rest_framework import status
 from rest_framework.response import Response
 from .import models
@@ -6,14 +7,228 @@ from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
 import unicodedata
 import re
+import calendar
+import tempfile
+import csv
+import base64
+import json
+import datetime
+from decimal import Decimal
+from collections import defaultdict
+from django.db import transaction
+from django.http import StreamingHttpResponse, FileResponse
 
 
-def reconfigure_rollNo(class_name):
-    # print(class_name)
-    students = models.Student.objects.filter(classOfAdmission=class_name).order_by('studentFirstName')
-    for new_rollNo, student in enumerate(students, start=1):
-        student.rollNo = new_rollNo
-        student.save()
+class GroupConcat(Aggregate):
+    """Concatenate the grouped values into one string: GROUP_CONCAT on SQLite/MySQL, STRING_AGG on PostgreSQL."""
+    function = 'GROUP_CONCAT'
+    name = 'GroupConcat'
+    output_field = CharField()
+
+    def __init__(self, expression, separator=',', **extra):
+        self.separator = separator
+        super().__init__(expression, **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = super().as_sql(compiler, connection, **extra_context)
+        if connection.vendor == 'mysql':
+            return sql[:-1] + ' SEPARATOR %s)', (*params, self.separator)
+        return sql[:-1] + ', %s)', (*params, self.separator)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, function='STRING_AGG', template='%(function)s(%(distinct)s%(expressions)s::text)', **extra_context)
+
+
+
+def encode_cursor(*values):
+    """Opaque keyset cursor from the sort key values of the last row of a page."""
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Raises ValueError for a malformed cursor."""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, UnicodeError):
+        raise ValueError("Invalid cursor")
+
+
+
+class Echo:
+    """File-like object whose write() hands the value back, for streaming csv.writer output."""
+    def write(self, value):
+        return value
+
+
+def stream_csv(header, rows):
+    """Yield a CSV document line by line so it can be sent with StreamingHttpResponse."""
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+
+
+def export_rows(header, rows, filename, export_format='csv'):
+    """
+    Response with `rows` (any iterable, ideally a queryset .iterator()) as an
+    attachment. CSV is streamed as it is produced; XLSX needs the optional
+    openpyxl package and is written by its write-only workbook to a temporary
+    file first, which keeps memory flat but sends nothing until it is done.
+    Raises ValueError for an unknown format or a missing openpyxl.
+    """
+    if export_format == 'csv':
+        response = StreamingHttpResponse(stream_csv(header, rows), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+        return response
+
+    if export_format != 'xlsx':
+        raise ValueError(f"export must be one of {', '.join(EXPORT_FORMATS)}")
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ValueError("XLSX export needs the openpyxl package, use export=csv")
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+    file = tempfile.TemporaryFile()
+    workbook.save(file)
+    file.seek(0)
+    return FileResponse(
+        file, as_attachment=True, filename=f"{filename}.xlsx",
+        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    )
+
+
+
+def get_page_size(request, default=50, maximum=200):
+    """Raises ValueError for a non-numeric page_size."""
+    return max(1, min(int(request.query_params.get('page_size', default)), maximum))
+
+
+
+ROLL_NO_ORDERINGS = {
+    'name': ['studentFirstName', 'studentMiddleName', 'studentLastName'],
+    # there is no admission date, ids follow the order students were enrolled in
+    'enrollment': ['id'],
+}
+
+
+def get_roll_no_ordering(ordering):
+    """Order expressions for 'name', 'enrollment' or a custom list of Student fields ('-field' for descending)."""
+    if isinstance(ordering, str):
+        if ordering not in ROLL_NO_ORDERINGS:
+            raise ValueError(f"Ordering must be one of {', '.join(ROLL_NO_ORDERINGS)} or a list of fields")
+        ordering = ROLL_NO_ORDERINGS[ordering]
+    if not isinstance(ordering, (list, tuple)) or not all(isinstance(field, str) for field in ordering):
+        raise ValueError("Ordering must be a list of student field names")
+
+    field_names = {field.name for field in models.Student._meta.concrete_fields}
+    expressions = []
+    for field in ordering:
+        name = field.lstrip('-')
+        if name not in field_names:
+            raise ValueError(f"Unknown student field '{name}'")
+        expressions.append(F(name).desc(nulls_last=True) if field.startswith('-') else F(name).asc(nulls_first=True))
+    return expressions + [F('id').asc()]
+
+
+def renumber_roll_nos(class_ids, ordering='name', dry_run=False):
+    """
+    Give the students of the classes roll numbers 1..n in the given ordering
+    (see get_roll_no_ordering). The numbers come from a RowNumber window in one
+    query and the changed ones are written with one bulk update, skipped on a
+    dry run. Returns the changes as [{'student_id', 'name', 'class_id', 'old', 'new'}].
+    """
+    numbered = models.Student.objects.filter(classOfAdmission_id__in=class_ids).annotate(
+        new_roll_no=Window(
+            RowNumber(),
+            partition_by=[F('classOfAdmission_id')],
+            order_by=get_roll_no_ordering(ordering),
+        )
+    ).only('id', 'rollNo', 'classOfAdmission_id', 'student_full_name').order_by('classOfAdmission_id', 'new_roll_no')
+
+    changes = []
+    changed = []
+    for student in numbered:
+        if student.rollNo != student.new_roll_no:
+            changes.append({
+                'student_id': student.id,
+                'name': student.student_full_name,
+                'class_id': student.classOfAdmission_id,
+                'old': student.rollNo,
+                'new': student.new_roll_no,
+            })
+            student.rollNo = student.new_roll_no
+            changed.append(student)
+
+    if not dry_run:
+        models.Student.objects.bulk_update(changed, ['rollNo'], batch_size=500)
+    return changes
+
+
+
+def promote_students(school, class_map=None, student_targets=None, renumber=False):
+    """
+    Move students between classes of `school`. `class_map` sends every student
+    of a class to another ({from_class_id: to_class_id}, None to clear the class
+    of a passing-out batch) and `student_targets` ({student_id: class_id})
+    overrides it per student. Everything is validated up front, then applied
+    with one UPDATE ... WHERE id IN per target class inside a transaction.
+    Returns [{'from': ..., 'to': ..., 'students': n}]. Raises ValueError for
+    classes or students outside the school.
+    """
+    class_map = {int(from_id): int(to_id) if to_id is not None else None for from_id, to_id in (class_map or {}).items()}
+    student_targets = {int(student_id): int(class_id) if class_id is not None else None for student_id, class_id in (student_targets or {}).items()}
+
+    class_ids = {class_id for class_id in [*class_map, *class_map.values(), *student_targets.values()] if class_id is not None}
+    unknown_classes = class_ids - set(models.Class.objects.filter(school=school, id__in=class_ids).values_list('id', flat=True))
+    if unknown_classes:
+        raise ValueError(f"Classes {sorted(unknown_classes)} don't exist")
+
+    # current class of every student that may move, read before anything is updated
+    current_classes = dict(
+        models.Student.objects.filter(school=school).filter(
+            Q(classOfAdmission_id__in=class_map) | Q(id__in=student_targets)
+        ).values_list('id', 'classOfAdmission_id')
+    )
+    unknown_students = set(student_targets) - set(current_classes)
+    if unknown_students:
+        raise ValueError(f"Students {sorted(unknown_students)} don't exist")
+
+    moves = defaultdict(list)
+    for student_id, from_id in current_classes.items():
+        to_id = student_targets[student_id] if student_id in student_targets else class_map.get(from_id, from_id)
+        if to_id != from_id:
+            moves[(from_id, to_id)].append(student_id)
+
+    students_by_target = defaultdict(list)
+    for (_, to_id), student_ids in moves.items():
+        students_by_target[to_id].extend(student_ids)
+
+    with transaction.atomic():
+        for to_id, student_ids in students_by_target.items():
+            for start in range(0, len(student_ids), 500):
+                models.Student.objects.filter(id__in=student_ids[start:start + 500]).update(classOfAdmission_id=to_id)
+
+        if renumber:
+            renumber_roll_nos({class_id for move in moves for class_id in move if class_id is not None})
+
+        # class_name and class_rank of the moved students' results follow the new class
+        moved_ids = [student_id for student_ids in moves.values() for student_id in student_ids]
+        for start in range(0, len(moved_ids), 500):
+            batch = moved_ids[start:start + 500]
+            refresh_student_exam_results(get_student_exams(batch))
+
+    return [
+        {'from': from_id, 'to': to_id, 'students': len(student_ids)}
+        for (from_id, to_id), student_ids in sorted(moves.items(), key=lambda move: (move[0][0] or 0, move[0][1] or 0))
+    ]
 
 
 
@@ -56,4 +271,636 @@ def normalize_text(text):
     """Normalize text by removing extra spaces and applying Unicode normalization."""
     text = unicodedata.normalize("NFKC", text)  # Normalize Unicode
     text = re.sub(r"\s+", " ", text).strip()  # Replace multiple spaces with a single space
-    return text
\ No newline at end of file
+    return text
+
+
+def ensure_attendance_sheet(class_id, date):
+    """Create the blank attendance rows missing for a class on the given date."""
+    # anti-join: students of the class that have no row for this date yet
+    missing_students = models.Student.objects.filter(classOfAdmission__id=class_id).exclude(
+        Exists(models.Attendance.objects.filter(student=OuterRef('pk'), date=date))
+    ).values_list('id', flat=True)
+
+    new_attendances = [
+        models.Attendance(student_id=student_id, date=date, status='')
+        for student_id in missing_students
+    ]
+    # the ('student', 'date') unique constraint makes concurrent openers safe
+    if new_attendances:
+        with transaction.atomic():
+            models.Attendance.objects.bulk_create(new_attendances, ignore_conflicts=True)
+            refresh_attendance_months((attendance.student_id, date) for attendance in new_attendances)
+
+    return len(new_attendances)
+
+
+
+def bulk_update_attendance_status(attendance_model, rows, school_filter):
+    """
+    Apply posted {'id', 'status'} rows in one transaction, one UPDATE per status.
+    Returns (results, updated_ids) where results holds a per-row outcome in payload order.
+    Raises ValueError when the payload is not a list. Student attendance also
+    gets its MonthlyAttendance rows refreshed in the same transaction.
+    """
+    valid_statuses = {choice for choice, _ in models.ATTENDANCE_STATUS} | {''}
+
+    if not isinstance(rows, list):
+        raise ValueError("Expected a list of {id, status} rows")
+
+    parsed_rows = []
+    for row in rows:
+        try:
+            attendance_id = int(row['id'])
+            attendance_status = row.get('status') or ''
+        except (KeyError, TypeError, ValueError, AttributeError):
+            parsed_rows.append((row.get('id') if isinstance(row, dict) else None, None, 'Invalid attendance id'))
+            continue
+        if attendance_status not in valid_statuses:
+            parsed_rows.append((attendance_id, None, f"Invalid status '{attendance_status}'"))
+            continue
+        parsed_rows.append((attendance_id, attendance_status, None))
+
+    # a single query tells us which of the posted ids belong to the caller's school
+    owned_ids = set(
+        attendance_model.objects.filter(
+            id__in=[attendance_id for attendance_id, _, error in parsed_rows if error is None],
+            **school_filter
+        ).values_list('id', flat=True)
+    )
+
+    results = []
+    status_by_id = {}
+    for attendance_id, attendance_status, error in parsed_rows:
+        if error is None and attendance_id not in owned_ids:
+            error = 'Attendance not found'
+        if error is None:
+            status_by_id[attendance_id] = attendance_status  # last posted status wins
+        results.append({'id': attendance_id, 'updated': error is None, 'error': error})
+
+    ids_by_status = defaultdict(list)
+    for attendance_id, attendance_status in status_by_id.items():
+        ids_by_status[attendance_status].append(attendance_id)
+
+    with transaction.atomic():
+        for attendance_status, ids in ids_by_status.items():
+            attendance_model.objects.filter(id__in=ids).update(status=attendance_status)
+        if attendance_model is models.Attendance:
+            refresh_attendance_months(
+                models.Attendance.objects.filter(id__in=status_by_id).values_list('student_id', 'date')
+            )
+
+    return results, list(status_by_id)
+
+
+
+
+def ensure_obtained_marks(students, exam_papers):
+    """
+    Create the zero ObtainedMark rows missing for every (student, paper) pair
+    of the given querysets with a single bulk insert.
+    """
+    student_ids = list(students.values_list('id', flat=True))
+    paper_ids = list(exam_papers.values_list('id', flat=True))
+    if not student_ids or not paper_ids:
+        return 0
+
+    existing_pairs = set(
+        models.ObtainedMark.objects.filter(
+            student_id__in=student_ids, paper_id__in=paper_ids
+        ).values_list('student_id', 'paper_id')
+    )
+
+    new_marks = [
+        models.ObtainedMark(student_id=student_id, paper_id=paper_id, marks=0)
+        for student_id in student_ids
+        for paper_id in paper_ids
+        if (student_id, paper_id) not in existing_pairs
+    ]
+    if new_marks:
+        models.ObtainedMark.objects.bulk_create(new_marks, ignore_conflicts=True)
+        paper_exams = dict(exam_papers.values_list('id', 'exam_id'))
+        refresh_student_exam_results((paper_exams[mark.paper_id], mark.student_id) for mark in new_marks)
+
+    return len(new_marks)
+
+
+
+def save_obtained_marks(cells, school, exam_id=None, class_id=None):
+    """
+    Validate and upsert a list of (student_id, paper_id, marks) cells in one
+    transaction. Students and papers are checked against the school (and the
+    exam/class when given) and marks against the paper's full marks.
+    Returns (errors, saved_cells) where errors maps student_id -> {paper_id: message}.
+    """
+    errors = defaultdict(dict)
+
+    papers = models.ExamPaper.objects.filter(id__in={paper_id for _, paper_id, _ in cells}, exam__school=school)
+    if exam_id is not None:
+        papers = papers.filter(exam_id=exam_id)
+    if class_id is not None:
+        papers = papers.filter(subject__class_name_id=class_id)
+    papers = {
+        paper['id']: paper
+        for paper in papers.values('id', 'exam_id', 'full_marks', class_id=F('subject__class_name_id'))
+    }
+
+    students = models.Student.objects.filter(id__in={student_id for student_id, _, _ in cells}, school=school)
+    if class_id is not None:
+        students = students.filter(classOfAdmission_id=class_id)
+    student_classes = dict(students.values_list('id', 'classOfAdmission_id'))
+
+    marks_by_cell = {}
+    for student_id, paper_id, marks in cells:
+        paper = papers.get(paper_id)
+        if student_id not in student_classes:
+            errors[student_id][paper_id] = "Student not found"
+            continue
+        if paper is None or paper['class_id'] != student_classes[student_id]:
+            errors[student_id][paper_id] = "Exam paper not found for this student's class"
+            continue
+
+        if marks in (None, ''):
+            marks_by_cell[(student_id, paper_id)] = None
+            continue
+        try:
+            marks = int(marks)
+        except (TypeError, ValueError):
+            errors[student_id][paper_id] = "Marks must be a whole number"
+            continue
+        if marks < 0 or (paper['full_marks'] is not None and marks > paper['full_marks']):
+            errors[student_id][paper_id] = f"Marks must be between 0 and {paper['full_marks']}"
+            continue
+        marks_by_cell[(student_id, paper_id)] = marks
+
+    with transaction.atomic():
+        models.ObtainedMark.objects.bulk_create(
+            [
+                models.ObtainedMark(student_id=student_id, paper_id=paper_id, marks=marks)
+                for (student_id, paper_id), marks in marks_by_cell.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['student', 'paper'],
+            update_fields=['marks'],
+        )
+        refresh_student_exam_results(
+            (papers[paper_id]['exam_id'], student_id) for student_id, paper_id in marks_by_cell
+        )
+
+    return dict(errors), list(marks_by_cell)
+
+
+
+def compute_exam_results(exam, students):
+    """
+    Per-student results of an exam computed in the database: total and full
+    marks, percentage, failed papers, rank within the class and rank across
+    every class sitting the exam. Only papers of the student's own class count.
+    """
+    this_exam = Q(
+        obtained_marks__paper__exam=exam,
+        obtained_marks__paper__subject__class_name=F('classOfAdmission'),
+    )
+    marks = Coalesce(F('obtained_marks__marks'), 0)
+
+    return students.annotate(
+        papers=Count('obtained_marks', filter=this_exam),
+        total=Coalesce(Sum(marks, filter=this_exam), 0),
+        full_marks=Coalesce(Sum('obtained_marks__paper__full_marks', filter=this_exam), 0),
+        failed_papers=Count('obtained_marks', filter=this_exam & (
+            Q(obtained_marks__marks__lt=F('obtained_marks__paper__pass_marks')) | Q(obtained_marks__marks__isnull=True)
+        )),
+    ).filter(papers__gt=0).annotate(
+        percentage=Cast(F('total'), FloatField()) * 100 / NullIf(F('full_marks'), 0),
+        class_rank=Window(Rank(), partition_by=F('classOfAdmission'), order_by=F('total').desc()),
+        exam_rank=Window(Rank(), order_by=F('percentage').desc()),
+        student_id=F('id'),
+        enr_no=F('enrollmentId'),
+        roll_no=F('rollNo'),
+        student_name=F('student_full_name'),
+        class_id=F('classOfAdmission'),
+        class_name=F('classOfAdmission__className'),
+    ).values(
+        'student_id', 'enr_no', 'roll_no', 'student_name', 'class_id', 'class_name',
+        'papers', 'total', 'full_marks', 'percentage', 'failed_papers', 'class_rank', 'exam_rank',
+    ).order_by('class_name', 'class_rank', 'student_name')
+
+
+
+def refresh_exam_results(exam_id, student_ids):
+    """
+    Recompute the ExamResult snapshots of the given students in one exam and
+    re-derive the class ranks of the classes they sit in.
+    """
+    student_ids = set(student_ids)
+    if not student_ids:
+        return 0
+
+    exam = models.Exam.objects.get(id=exam_id)
+    results = list(compute_exam_results(exam, models.Student.objects.filter(id__in=student_ids)))
+
+    with transaction.atomic():
+        # classes the students are ranked in before the refresh, they lose a member when a student moves
+        affected_classes = set(models.ExamResult.objects.filter(exam=exam, student_id__in=student_ids).values_list('class_name', flat=True))
+
+        # students left without papers in this exam (e.g. moved class) lose their snapshot
+        models.ExamResult.objects.filter(exam=exam, student_id__in=student_ids).exclude(
+            student_id__in=[result['student_id'] for result in results]
+        ).delete()
+
+        models.ExamResult.objects.bulk_create(
+            [
+                models.ExamResult(
+                    student_id=result['student_id'],
+                    exam=exam,
+                    class_name_id=result['class_id'],
+                    total=result['total'],
+                    full_marks=result['full_marks'],
+                    percentage=None if result['percentage'] is None else round(result['percentage'], 2),
+                    failed_papers=result['failed_papers'],
+                    grade=models.ExamResult.get_grade(result['percentage']),
+                )
+                for result in results
+            ],
+            update_conflicts=True,
+            unique_fields=['student', 'exam'],
+            update_fields=['class_name', 'total', 'full_marks', 'percentage', 'failed_papers', 'grade', 'updated_at'],
+        )
+
+        affected_classes.update(result['class_id'] for result in results)
+        rerank_exam_results(exam.id, affected_classes)
+
+    return len(results)
+
+
+
+def rerank_exam_results(exam_id, class_ids):
+    """Re-derive the class_rank of every ExamResult of the given classes in one exam."""
+    reranked = [
+        models.ExamResult(id=result['id'], class_rank=result['new_rank'])
+        for result in models.ExamResult.objects.filter(exam_id=exam_id, class_name__in=class_ids).annotate(
+            new_rank=Window(Rank(), partition_by=F('class_name'), order_by=F('total').desc())
+        ).values('id', 'class_rank', 'new_rank')
+        if result['class_rank'] != result['new_rank']
+    ]
+    models.ExamResult.objects.bulk_update(reranked, ['class_rank'], batch_size=500)
+    return len(reranked)
+
+
+
+def refresh_student_exam_results(exam_students):
+    """
+    Refresh the ExamResult snapshots of the given (exam_id, student_id) pairs,
+    one refresh_exam_results per exam. Every path that changes marks, papers or
+    a student's class calls this; when marks are deleted, collect the pairs
+    before the delete.
+    """
+    students_by_exam = defaultdict(set)
+    for exam_id, student_id in exam_students:
+        students_by_exam[exam_id].add(student_id)
+
+    with transaction.atomic():
+        return sum(refresh_exam_results(exam_id, student_ids) for exam_id, student_ids in students_by_exam.items())
+
+
+
+def get_exam_students(marks):
+    """(exam_id, student_id) pairs of an ObtainedMark queryset, evaluated right away."""
+    return list(marks.values_list('paper__exam_id', 'student_id').distinct())
+
+
+
+def get_student_exams(student_ids):
+    """
+    (exam_id, student_id) pairs of every exam the students have a snapshot or
+    marks in: what needs a refresh once the students change class.
+    """
+    return [
+        *models.ExamResult.objects.filter(student_id__in=student_ids).values_list('exam_id', 'student_id'),
+        *get_exam_students(models.ObtainedMark.objects.filter(student_id__in=student_ids)),
+    ]
+
+
+
+def refresh_fee_accounts(student_ids):
+    """Recompute the StudentFeeAccount rows of the given students from their receipts."""
+    student_ids = set(student_ids)
+    if not student_ids:
+        return 0
+
+    balances = dict(
+        models.Receipt.objects.filter(student_id__in=student_ids).values('student_id').annotate(
+            balance=Sum('remaining_fees')
+        ).values_list('student_id', 'balance')
+    )
+
+    paid_months = defaultdict(list)
+    for student_id, month_id, month_name in models.Receipt.months.through.objects.filter(
+        receipt__student_id__in=student_ids
+    ).values_list('receipt__student_id', 'month_id', 'month__name').distinct().order_by('month_id'):
+        paid_months[student_id].append({'id': month_id, 'name': month_name})
+
+    models.StudentFeeAccount.objects.bulk_create(
+        [
+            models.StudentFeeAccount(
+                student_id=student_id,
+                outstanding_fees=balances.get(student_id) or 0,
+                paid_months=paid_months.get(student_id, []),
+            )
+            for student_id in student_ids
+        ],
+        update_conflicts=True,
+        unique_fields=['student'],
+        update_fields=['outstanding_fees', 'paid_months', 'updated_at'],
+    )
+    return len(student_ids)
+
+
+
+def refresh_fee_collections(school_days):
+    """
+    Recompute the FeeCollection rollups of the given (school_id, date) pairs
+    from their receipts: one lock, one grouped aggregate, one delete and one
+    insert. Refreshes of the same school-day are serialized on its
+    ReceiptSequence row, so two cashiers posting at once can't interleave the
+    delete and the insert and leave duplicate or double-counted rows.
+    """
+    days_by_school = defaultdict(set)
+    for school_id, day in school_days:
+        if day:
+            days_by_school[school_id].add(day)
+    if not days_by_school:
+        return 0
+
+    rollup_filter = Q()
+    receipt_filter = Q()
+    for school_id, days in days_by_school.items():
+        rollup_filter |= Q(school_id=school_id, date__in=days)
+        receipt_filter |= Q(student__school_id=school_id, receipt_date__in=days)
+
+    with transaction.atomic():
+        models.ReceiptSequence.objects.bulk_create(
+            [models.ReceiptSequence(school_id=school_id, date=day) for school_id, days in days_by_school.items() for day in days],
+            ignore_conflicts=True,
+        )
+        # always in the same order so concurrent refreshes can't deadlock
+        list(models.ReceiptSequence.objects.select_for_update().filter(rollup_filter).order_by('school_id', 'date').values_list('id'))
+
+        # aggregated once the lock is held, so the other writer's committed receipts are counted
+        totals = models.Receipt.objects.filter(receipt_filter).values(
+            collection_school=F('student__school_id'),
+            collection_date=F('receipt_date'),
+            collection_mode=Coalesce('payment_mode', Value('')),
+            collection_class=Coalesce('class_name_id', 'student__classOfAdmission_id'),
+        ).annotate(
+            receipt_count=Count('id'),
+            total_deposit=Sum('deposit_fees'),
+            total_concession=Sum('concession_amount'),
+            total_net=Sum('net_fees'),
+        ).order_by()
+
+        models.FeeCollection.objects.filter(rollup_filter).delete()
+        models.FeeCollection.objects.bulk_create([
+            models.FeeCollection(
+                school_id=row['collection_school'],
+                date=row['collection_date'],
+                payment_mode=row['collection_mode'],
+                class_name_id=row['collection_class'],
+                receipt_count=row['receipt_count'],
+                deposit_fees=row['total_deposit'] or 0,
+                concession_amount=row['total_concession'] or 0,
+                net_fees=row['total_net'] or 0,
+            )
+            for row in totals
+        ])
+    return sum(len(days) for days in days_by_school.values())
+
+
+
+def settle_old_receipts(receipt):
+    """
+    Clear the dues of the student's older receipts that the deposit of the
+    saved `receipt` fully covers, oldest first. The receipt's deposit_fees is
+    left alone (it is the cash received); the cleared dues are recorded as
+    ReceiptSettlement rows. Returns the settled amount.
+    """
+    return settle_dues([receipt])[receipt.pk]
+
+
+
+def settle_dues(receipts):
+    """
+    Set-wise settle_old_receipts for saved receipts of different students:
+    one read of the older receipts with dues, one bulk update and one insert
+    of the settlements. Returns {receipt id: settled amount}.
+    """
+    available = {receipt.student_id: Decimal(str(receipt.deposit_fees or 0)) for receipt in receipts}
+    paying_receipts = {receipt.student_id: receipt.pk for receipt in receipts}
+    settled_amounts = {receipt.pk: Decimal(0) for receipt in receipts}
+
+    settled = []
+    settlements = []
+    for receipt in models.Receipt.objects.filter(
+        student_id__in=available, remaining_fees__gt=0
+    ).exclude(id__in=settled_amounts).only('id', 'student_id', 'remaining_fees').order_by('student_id', 'receipt_date', 'id'):
+        if available[receipt.student_id] >= receipt.remaining_fees:
+            paying_receipt_id = paying_receipts[receipt.student_id]
+            available[receipt.student_id] -= receipt.remaining_fees
+            settled_amounts[paying_receipt_id] += receipt.remaining_fees
+            settlements.append(models.ReceiptSettlement(receipt_id=paying_receipt_id, settled_receipt_id=receipt.id, amount=receipt.remaining_fees))
+            receipt.remaining_fees = 0
+            settled.append(receipt)
+
+    models.Receipt.objects.bulk_update(settled, ['remaining_fees'], batch_size=500)
+    models.ReceiptSettlement.objects.bulk_create(settlements, batch_size=500)
+    return settled_amounts
+
+
+
+def get_fee_dues(students, until_month=None):
+    """
+    Annotate students with their fee dues in one query: outstanding
+    remaining_fees, the due months (Month ids up to `until_month`) they have
+    not paid yet and the expected total (outstanding + monthly fee x unpaid
+    months). Returns (queryset, due_months) where due_months is [(id, name)].
+    """
+    due_months = models.Month.objects.order_by('id')
+    if until_month is not None:
+        due_months = due_months.filter(id__lte=until_month)
+    due_months = list(due_months.values_list('id', 'name'))
+    due_month_ids = [month_id for month_id, _ in due_months]
+
+    receipt_months = models.Receipt.months.through.objects.filter(receipt__student=OuterRef('pk')).values('receipt__student')
+
+    outstanding = models.Receipt.objects.filter(student=OuterRef('pk')).values('student').annotate(
+        total=Sum('remaining_fees')
+    ).values('total')
+    paid_due_count = receipt_months.filter(month_id__in=due_month_ids).annotate(
+        paid=Count('month_id', distinct=True)
+    ).values('paid')
+    paid_month_ids = receipt_months.annotate(ids=GroupConcat('month_id')).values('ids')
+
+    unpaid_count = Value(len(due_month_ids)) - Coalesce(Subquery(paid_due_count), 0)
+
+    students = students.filter(classOfAdmission__isnull=False).annotate(
+        student_id=F('id'),
+        enr_no=F('enrollmentId'),
+        roll_no=F('rollNo'),
+        student_name=F('student_full_name'),
+        class_id=F('classOfAdmission_id'),
+        class_name=F('classOfAdmission__className'),
+        monthly_fee=Coalesce(F('classOfAdmission__monthlyFees'), 0),
+        outstanding_fees=Coalesce(Subquery(outstanding), Value(Decimal(0)), output_field=DecimalField(max_digits=20, decimal_places=2)),
+        unpaid_months_count=unpaid_count,
+        expected_total=ExpressionWrapper(
+            F('outstanding_fees') + F('monthly_fee') * F('unpaid_months_count'),
+            output_field=DecimalField(max_digits=20, decimal_places=2),
+        ),
+        paid_month_ids=Subquery(paid_month_ids),
+    )
+    return students, due_months
+
+
+
+def get_signed_amount():
+    """IncomeExpense.amount as income (+) or expense (-), using ChartOfAccountQuerySet.expenses()."""
+    return Case(
+        When(head__in=models.ChartOfAccount.objects.expenses(), then=-F('amount')),
+        default=F('amount'),
+        output_field=DecimalField(max_digits=50, decimal_places=2),
+    )
+
+
+
+def get_income_expense_totals():
+    """Aggregates of income, expense and their difference for IncomeExpense rows."""
+    income = Coalesce(Sum('amount', filter=Q(head__in=models.ChartOfAccount.objects.incomes())), Value(Decimal(0)))
+    expense = Coalesce(Sum('amount', filter=Q(head__in=models.ChartOfAccount.objects.expenses())), Value(Decimal(0)))
+    return {
+        'income': income,
+        'expense': expense,
+        'profit': ExpressionWrapper(income - expense, output_field=DecimalField(max_digits=50, decimal_places=2)),
+    }
+
+
+
+def get_date_range(year, month=None):
+    """
+    Half-open [start, end) date bounds for a year or a month. Filtering with
+    date__gte/date__lt keeps the date indexes usable, unlike __year/__month.
+    """
+    if month is None:
+        return datetime.date(year, 1, 1), datetime.date(year + 1, 1, 1)
+    if month == 12:
+        return datetime.date(year, 12, 1), datetime.date(year + 1, 1, 1)
+    return datetime.date(year, month, 1), datetime.date(year, month + 1, 1)
+
+
+
+def refresh_monthly_attendance(student_months):
+    """
+    Re-pack the MonthlyAttendance rows for the given (student_id, year, month)
+    triples from their Attendance rows: one read and one upsert. A student-month
+    without any Attendance row loses its MonthlyAttendance row, so a row exists
+    exactly when the student is on that month's register, marked or not.
+
+    Refreshes of the same student-month are serialized on its MonthlyAttendance
+    row, so two writers (today's sheet and a correction to yesterday's) can't
+    each miss the other's day and have the last upsert drop a status.
+    """
+    student_months = set(student_months)
+    if not student_months:
+        return 0
+
+    students_by_month = defaultdict(set)
+    for student_id, year, month in student_months:
+        students_by_month[(year, month)].add(student_id)
+
+    month_filter = Q()
+    row_filter = Q()
+    for (year, month), student_ids in students_by_month.items():
+        start, end = get_date_range(year, month)
+        month_filter |= Q(student_id__in=student_ids, date__gte=start, date__lt=end)
+        row_filter |= Q(student_id__in=student_ids, year=year, month=month)
+
+    with transaction.atomic():
+        models.MonthlyAttendance.objects.bulk_create(
+            [models.MonthlyAttendance(student_id=student_id, year=year, month=month) for student_id, year, month in student_months],
+            ignore_conflicts=True,
+        )
+        # always in the same order so concurrent refreshes can't deadlock
+        list(models.MonthlyAttendance.objects.select_for_update().filter(row_filter).order_by('student_id', 'year', 'month').values_list('id'))
+
+        # read once the lock is held, so the other writer's committed days are packed too
+        day_statuses = defaultdict(dict)
+        for student_id, date, attendance_status in models.Attendance.objects.filter(month_filter).values_list('student_id', 'date', 'status'):
+            day_statuses[(student_id, date.year, date.month)][date.day] = attendance_status
+
+        monthly_attendances = [
+            models.MonthlyAttendance.from_day_statuses(student_id, year, month, day_statuses[(student_id, year, month)])
+            for student_id, year, month in student_months
+            if (student_id, year, month) in day_statuses
+        ]
+        emptied = Q()
+        for student_id, year, month in student_months:
+            if (student_id, year, month) not in day_statuses:
+                emptied |= Q(student_id=student_id, year=year, month=month)
+        if emptied:
+            models.MonthlyAttendance.objects.filter(emptied).delete()
+
+        models.MonthlyAttendance.objects.bulk_create(
+            monthly_attendances,
+            update_conflicts=True,
+            unique_fields=['student', 'year', 'month'],
+            update_fields=['packed_statuses', 'total_present', 'total_absent', 'total_leave', 'updated_at'],
+        )
+    return len(monthly_attendances)
+
+
+
+def refresh_attendance_months(student_dates):
+    """
+    Refresh the MonthlyAttendance rows of the months touched by the given
+    (student_id, date) pairs. Every write to Attendance goes through here so
+    the packed register never falls behind.
+    """
+    return refresh_monthly_attendance(
+        (student_id, date.year, date.month)
+        for student_id, date in student_dates
+        if date is not None
+    )
+
+
+
+def get_monthly_attendance_rows(students, year, month):
+    """
+    Values queryset of the students' MonthlyAttendance rows, in register order.
+    Students whose sheet is open but not yet marked come back with every day unmarked.
+    """
+    return models.MonthlyAttendance.objects.filter(
+        student__in=students, year=year, month=month
+    ).annotate(
+        rollNo=F('student__rollNo'),
+        name=F('student__student_full_name'),
+        className=F('student__classOfAdmission__className'),
+        totalP=F('total_present'),
+        totalA=F('total_absent'),
+        totalL=F('total_leave'),
+    ).values(
+        'student_id', 'rollNo', 'name', 'className', 'packed_statuses', 'totalP', 'totalA', 'totalL'
+    ).order_by('rollNo', 'name')
+
+
+def get_monthly_attendance_register(students, year, month):
+    """
+    Build the monthly register for the given students from their packed
+    MonthlyAttendance rows: one fixed-length status string per student (one
+    character per day, '-' when unmarked) plus the P/A/L totals.
+    """
+    days_in_month = calendar.monthrange(year, month)[1]
+
+    response = []
+    for row in get_monthly_attendance_rows(students, year, month):
+        row['studentId'] = row.pop('student_id')
+        row['status'] = models.MonthlyAttendance.unpack(row.pop('packed_statuses'), days_in_month)
+        response.append(row)
+    return response
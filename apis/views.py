@@ -1,6 +1,6 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse
 
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from . import serializers
@@ -11,18 +11,27 @@ from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenBlacklistView
 from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
 from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, parser_classes
 
-from django.db.models import F, Value, Count, Case, When, Sum, Q
+from django.db.models import F, Value, Count, Case, When, Sum, Q, Window, OuterRef, Subquery
 
-from django.db.models.functions import Concat
+from django.db.models.functions import Concat, TruncMonth, Coalesce
+from django.utils import timezone
+from datetime import timedelta
+from decimal import Decimal
 from collections import defaultdict
+from itertools import groupby
+import calendar
 from rest_framework.exceptions import ValidationError
 from django.shortcuts import get_object_or_404
 from rest_framework.generics import ListAPIView
 from django.db import transaction
 from django.db import IntegrityError
-from .utils import reconfigure_rollNo, normalize_text
+from django.core.exceptions import ValidationError as DjangoValidationError
+from .search import search_students
+from .imports import read_rows, import_income_expenses, import_students
+from .documents import get_receipt_documents, get_statement_documents, render_documents, bundle_documents
+from .utils import promote_students, renumber_roll_nos, normalize_text, ensure_attendance_sheet, bulk_update_attendance_status, get_monthly_attendance_register, get_date_range, ensure_obtained_marks, save_obtained_marks, compute_exam_results, refresh_exam_results, refresh_student_exam_results, get_exam_students, refresh_fee_accounts, settle_old_receipts, settle_dues, GroupConcat, encode_cursor, decode_cursor, get_page_size, get_fee_dues, refresh_fee_collections, get_signed_amount, get_income_expense_totals, export_rows, get_monthly_attendance_rows
 
 
 
@@ -234,8 +243,42 @@ class StudentViewSet(viewsets.ModelViewSet):
             # raise PermissionError('User is not authenticated')
             return models.Student.objects.none()
 
-        return super().get_queryset().filter(school=self.request.user.school).order_by('studentFirstName')
-    
+        return super().get_queryset().filter(school=self.request.user.school).order_by(F('studentFirstName').asc(nulls_first=True), 'id')
+
+
+    def list(self, request, *args, **kwargs):
+        # ?fields=id,rollNo,studentFirstName&page_size=50&cursor=...; without page_size/cursor the whole list comes back
+        params = request.query_params
+        students = self.get_queryset()
+
+        fields = None
+        if params.get('fields'):
+            fields = [field for field in params['fields'].split(',') if field]
+            unknown = set(fields) - set(self.serializer_class.Meta.fields)
+            if unknown:
+                return Response({"message": f"Unknown fields: {', '.join(sorted(unknown))}"}, status=status.HTTP_400_BAD_REQUEST)
+            # the cursor needs studentFirstName even when it isn't returned
+            students = students.only('id', 'studentFirstName', *fields)
+
+        if 'page_size' not in params and 'cursor' not in params:
+            return Response(self.get_serializer(students, many=True, fields=fields).data)
+
+        try:
+            page_size = get_page_size(request)
+            if params.get('cursor'):
+                last_name, last_id = decode_cursor(params['cursor'])
+                if last_name is None:
+                    students = students.filter(Q(studentFirstName__isnull=True, id__gt=last_id) | Q(studentFirstName__isnull=False))
+                else:
+                    students = students.filter(Q(studentFirstName__gt=last_name) | Q(studentFirstName=last_name, id__gt=last_id))
+        except (ValueError, TypeError):
+            return Response({"message": "Invalid cursor"}, status=status.HTTP_400_BAD_REQUEST)
+
+        students = list(students[:page_size + 1])
+        next_cursor = encode_cursor(students[page_size - 1].studentFirstName, students[page_size - 1].id) if len(students) > page_size else None
+        serializer = self.get_serializer(students[:page_size], many=True, fields=fields)
+        return Response({"results": serializer.data, "next_cursor": next_cursor})
+
     
     def perform_create(self, serializer):
         student = serializer.save()  # The saved Student instance will be returned
@@ -243,28 +286,71 @@ class StudentViewSet(viewsets.ModelViewSet):
     
 
 
+@api_view(["POST"])
+@parser_classes([MultiPartParser, FormParser])
+def import_student(request):
+    # multipart 'file': CSV or XLSX, one student per row with Student field columns and a class column
+    file = request.FILES.get('file')
+    if not file:
+        return Response({"message": "Upload a CSV or XLSX file"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        created, errors = import_students(request.user.school, read_rows(file, file.name))
+    except ValueError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if errors:
+        return Response({"message": "Nothing was imported, fix the listed lines", "errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({"message": f"{created} students imported successfully", "created": created}, status=status.HTTP_201_CREATED)
+
+
+
 @api_view(["POST"])
 def promote_student(request):
+    # [{'id': 47, 'classOfAdmission': 3}, ...]
+    # or {'class_map': {'2': 3, '10': null}, 'students': [{'id': 47, 'classOfAdmission': 3}], 'renumber': true}
+    data = request.data
+    try:
+        if isinstance(data, list):
+            data = {'students': data}
+        student_targets = {student['id']: student['classOfAdmission'] for student in data.get('students') or []}
+        moves = promote_students(
+            request.user.school,
+            class_map=data.get('class_map'),
+            student_targets=student_targets,
+            renumber=bool(data.get('renumber')),
+        )
+    except ValueError as e:
+        return Response({"message": f"Failed to promote students: {e}"}, status=status.HTTP_400_BAD_REQUEST)
+    except (KeyError, TypeError, AttributeError):
+        return Response({"message": "Invalid promotion data"}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({"message": "Students promoted successfully", "moves": moves}, status=status.HTTP_200_OK)
+
+
+
+@api_view(["POST"])
+def renumber_rollNo(request):
+    # {'class_id': 2 (omit for the whole school), 'ordering': 'name' | 'enrollment' | ['gender', 'studentFirstName'], 'dry_run': true}
+    data = request.data
+    classes = models.Class.objects.filter(school=request.user.school)
+    if data.get('class_id'):
+        try:
+            classes = classes.filter(id=int(data['class_id']))
+        except (ValueError, TypeError):
+            return Response({"message": "class_id must be a number"}, status=status.HTTP_400_BAD_REQUEST)
+        if not classes.exists():
+            return Response({"message": "Class doesn't exist"}, status=status.HTTP_400_BAD_REQUEST)
 
+    dry_run = bool(data.get('dry_run'))
     try:
-        for student_data in request.data:
-            student_id = student_data['id']
-            student = models.Student.objects.get(id=student_id)
-            if student.classOfAdmission.id != int(student_data['classOfAdmission']):
-                previous_class = student.classOfAdmission
-                new_class = models.Class.objects.get(id=student_data['classOfAdmission'])
-                
-                student.classOfAdmission = new_class
-                student.save()
-                
-                # from .utils import reconfigure_rollNo
-                # reconfigure_rollNo(new_class)
-                # reconfigure_rollNo(previous_class)
-          
-    except Exception as e:
-        return Response({"message": "Failed to promote students"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    
-    return Response({"message": "Students promoted successfully"}, status=status.HTTP_200_OK)
+        with transaction.atomic():
+            changes = renumber_roll_nos(classes.values('id'), ordering=data.get('ordering') or 'name', dry_run=dry_run)
+    except ValueError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    message = f"{len(changes)} roll numbers would change" if dry_run else "Roll numbers reconfigured successfully"
+    return Response({"message": message, "dry_run": dry_run, "changes": changes}, status=status.HTTP_200_OK)
 
 
 
@@ -456,6 +542,13 @@ class ClassSubjectViewSet(viewsets.ModelViewSet):
         else:
             # raise PermissionError("User is not authenticated")
             return models.ClassSubject.objects.none()
+
+    def perform_destroy(self, instance):
+        # deleting a subject takes its exam papers and their marks along
+        with transaction.atomic():
+            exam_students = get_exam_students(models.ObtainedMark.objects.filter(paper__subject=instance))
+            instance.delete()
+            refresh_student_exam_results(exam_students)
         
 
     # def list(self, request, *args, **kwargs):
@@ -662,10 +755,13 @@ def update_class_subjects(request):
     _class = models.Class.objects.get(id=class_id)
     subjects = models.ClassSubject.objects.filter(class_name=_class)
     
-    for subject in subjects:
-        if subject.id not in updated_subjects_ids:
-            # print("delete", subject)
-            subject.delete()
+    removed_subjects = subjects.exclude(id__in=updated_subjects_ids)
+    # deleting a subject takes its exam papers and their marks along
+    exam_students = get_exam_students(models.ObtainedMark.objects.filter(paper__subject__in=removed_subjects))
+    for subject in removed_subjects:
+        # print("delete", subject)
+        subject.delete()
+    refresh_student_exam_results(exam_students)
             
                         
     for subject in updated_subjects:
@@ -769,6 +865,113 @@ def get_income_expenses(request):
 
 
 
+@api_view(['GET'])
+def get_income_expense_ledger(request):
+    # cash book in date order: ?date_from=&date_to=&head=&page_size=&cursor=
+    params = request.query_params
+    entries = models.IncomeExpense.objects.filter(school=request.user.school, date__isnull=False)
+
+    try:
+        page_size = get_page_size(request, default=100, maximum=500)
+        if params.get('head'):
+            entries = entries.filter(head_id=int(params['head']))
+        # entries before the page make up its opening balance
+        page_entries = entries
+        opening_filter = Q(pk__in=[])
+        if params.get('date_from'):
+            page_entries = page_entries.filter(date__gte=params['date_from'])
+            opening_filter = Q(date__lt=params['date_from'])
+        if params.get('date_to'):
+            page_entries = page_entries.filter(date__lte=params['date_to'])
+        if params.get('cursor'):
+            last_date, last_id = decode_cursor(params['cursor'])
+            after_cursor = Q(date__gt=last_date) | Q(date=last_date, id__gt=last_id)
+            page_entries = page_entries.filter(after_cursor)
+            opening_filter |= ~after_cursor
+    except (ValueError, TypeError, DjangoValidationError):
+        return Response({"message": "Invalid filter or cursor"}, status=status.HTTP_400_BAD_REQUEST)
+
+    signed_amount = get_signed_amount()
+    opening_balance = entries.filter(opening_filter).aggregate(
+        balance=Coalesce(Sum(signed_amount), Value(Decimal(0)))
+    )['balance']
+
+    ledger = list(page_entries.annotate(
+        head_name=F('head__head'),
+        head_type=F('head__type'),
+        balance=Window(Sum(signed_amount), order_by=[F('date').asc(), F('id').asc()]),
+    ).values(
+        'id', 'date', 'head', 'head_name', 'head_type', 'particulars', 'amount', 'balance'
+    ).order_by('date', 'id')[:page_size + 1])
+
+    next_cursor = encode_cursor(str(ledger[page_size - 1]['date']), ledger[page_size - 1]['id']) if len(ledger) > page_size else None
+    ledger = ledger[:page_size]
+    for entry in ledger:
+        entry['balance'] = opening_balance + Decimal(str(entry['balance'] or 0))
+
+    return Response({"opening_balance": opening_balance, "results": ledger, "next_cursor": next_cursor}, status=status.HTTP_200_OK)
+
+
+
+@api_view(['GET'])
+def get_income_expense_summary(request):
+    # profit/loss of a period: ?date_from=&date_to=&group_by=head|month|type
+    params = request.query_params
+    entries = models.IncomeExpense.objects.filter(school=request.user.school)
+    try:
+        if params.get('date_from'):
+            entries = entries.filter(date__gte=params['date_from'])
+        if params.get('date_to'):
+            entries = entries.filter(date__lte=params['date_to'])
+    except DjangoValidationError:
+        return Response({"message": "Dates must be in YYYY-MM-DD format"}, status=status.HTTP_400_BAD_REQUEST)
+
+    group_by = params.get('group_by', 'head')
+    if group_by == 'head':
+        results = entries.values('head').annotate(
+            head_name=F('head__head'),
+            head_type=F('head__type'),
+            entries=Count('id'),
+            total=Sum('amount'),
+        ).order_by('head_type', 'head_name')
+    elif group_by == 'month':
+        results = entries.filter(date__isnull=False).annotate(month=TruncMonth('date')).values('month').annotate(
+            entries=Count('id'),
+            **get_income_expense_totals(),
+        ).order_by('month')
+    elif group_by == 'type':
+        results = entries.values(type=F('head__type')).annotate(
+            entries=Count('id'),
+            total=Sum('amount'),
+        ).order_by('type')
+    else:
+        return Response({"message": "group_by must be head, month or type"}, status=status.HTTP_400_BAD_REQUEST)
+
+    totals = entries.aggregate(**get_income_expense_totals())
+    return Response({**totals, "results": results}, status=status.HTTP_200_OK)
+
+
+
+
+@api_view(['POST'])
+@parser_classes([MultiPartParser, FormParser])
+def import_income_expense(request):
+    # multipart 'file': CSV or XLSX with date, head, amount[, particulars, type] columns
+    file = request.FILES.get('file')
+    if not file:
+        return Response({"message": "Upload a CSV or XLSX file"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        created, errors = import_income_expenses(request.user.school, read_rows(file, file.name))
+    except ValueError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if errors:
+        return Response({"message": "Nothing was imported, fix the listed lines", "errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({"message": f"{created} entries imported successfully", "created": created}, status=status.HTTP_201_CREATED)
+
+
+
 @api_view(['DELETE'])
 def delete_income_expense(request, id):
     deleted = models.IncomeExpense.objects.filter(id=id).delete()
@@ -923,9 +1126,13 @@ def get_exam_papers(request, exam_id):
 @api_view(['DELETE'])
 def delete_exam_paper(request, paper_id):
     # print(paper_id)
-    deleted = models.ExamPaper.objects.filter(id=paper_id).delete()
-    if not deleted:
-        return Response({"message": "Failed to delete Exam paper"}, status=status.HTTP_400_BAD_REQUEST)
+    with transaction.atomic():
+        exam_students = get_exam_students(models.ObtainedMark.objects.filter(paper_id=paper_id))
+        deleted, _ = models.ExamPaper.objects.filter(id=paper_id).delete()
+        if not deleted:
+            return Response({"message": "Failed to delete Exam paper"}, status=status.HTTP_400_BAD_REQUEST)
+        # the paper's marks no longer count towards the snapshots
+        refresh_student_exam_results(exam_students)
     return Response({"message": "Exam paper deleted successfully"}, status=status.HTTP_204_NO_CONTENT)
 
 
@@ -962,6 +1169,9 @@ def update_exam_papers(request):
                 )
             except models.ExamPaper.DoesNotExist:
                 return Response({"error": f"Exam paper with id {paper['exam_paper_id']} does not exist"}, status=status.HTTP_400_BAD_REQUEST)
+
+    # full/pass marks feed every snapshot of this exam
+    refresh_exam_results(exam.id, models.ObtainedMark.objects.filter(paper__exam=exam).values_list('student_id', flat=True).distinct())
     
     return Response({"message": "Exam papers updated successfully"}, status=status.HTTP_201_CREATED)
 
@@ -1088,18 +1298,10 @@ def get_students_for_marks_entry(request,exam_id, class_id):
 
     exam = get_object_or_404(models.Exam, id=exam_id)
 
-    try:
-        exam_papers = models.ExamPaper.objects.filter(exam=exam)
-    except models.ExamPaper.DoesNotExist:
-        return Response({"message": "Exam Papers doesn't exist"}, status=status.HTTP_400_BAD_REQUEST)
+    # only this class's papers; other classes' papers of a school-wide exam are skipped
+    exam_papers = models.ExamPaper.objects.filter(exam=exam, subject__class_name=class_name)
+    ensure_obtained_marks(students, exam_papers)
 
-    for student in students:
-        for paper in exam_papers:
-            try:
-                mark = models.ObtainedMark.objects.get(student=student, paper=paper)
-            except models.ObtainedMark.DoesNotExist:
-                models.ObtainedMark.objects.create(student=student, paper=paper, marks=0)
-                
 
 
     obtained_marks =  models.ObtainedMark.objects.filter(
@@ -1165,16 +1367,54 @@ def update_marks(request):
     # print(request.data)
     # {'student_id': 47, 'enr_no': 'ENR-EE45D3C93C', 'student_name': 'Amanda Troy Gonzalez', 'father_name': 'Christopher Jesse Evans', 'marks': [{'paper_id': 2, 'paper_name': 'Nepali', 'mark_id': 175, 'marks': '10', 'paper_full_marks': 100, 'paper_pass_marks': 40}, {'paper_id': 3, 'paper_name': 'Computer Science', 'mark_id': 176, 'marks': '20', 'paper_full_marks': 50, 'paper_pass_marks': 20}]}
 
-    student = get_object_or_404(models.Student, id=request.data['student_id'])
-    for paper in request.data['marks']:
-        exam_paper = get_object_or_404(models.ExamPaper, id=paper['paper_id'])
+    try:
+        student_id = int(request.data['student_id'])
+        cells = [(student_id, int(paper['paper_id']), paper.get('marks')) for paper in request.data['marks']]
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return Response({"message": "Invalid marks data"}, status=status.HTTP_400_BAD_REQUEST)
 
-        mark = get_object_or_404(models.ObtainedMark, student=student, paper=exam_paper)
-        mark.marks = paper['marks']
-        mark.save()
+    errors, saved_cells = save_obtained_marks(cells, request.user.school)
 
+    # the valid cells are saved either way, like update_class_marks
+    response = {
+        "message": "Marks updated successfully",
+        "saved": len(saved_cells),
+        "errors": errors,
+    }
+    if errors:
+        response["message"] = "Some marks could not be updated"
+        return Response(response, status=status.HTTP_207_MULTI_STATUS)
 
-    return Response({"message": "Marks updated successfully"}, status=status.HTTP_200_OK)
+    return Response(response, status=status.HTTP_200_OK)
+
+
+
+@api_view(['POST'])
+def update_class_marks(request):
+    # {'exam_id': 1, 'class_id': 2, 'students': [{'student_id': 47, 'marks': [{'paper_id': 2, 'marks': '10'}, ...]}, ...]}
+    try:
+        exam_id = int(request.data['exam_id'])
+        class_id = int(request.data['class_id'])
+        cells = [
+            (int(student['student_id']), int(paper['paper_id']), paper.get('marks'))
+            for student in request.data['students']
+            for paper in student['marks']
+        ]
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return Response({"message": "Invalid marks data"}, status=status.HTTP_400_BAD_REQUEST)
+
+    errors, saved_cells = save_obtained_marks(cells, request.user.school, exam_id=exam_id, class_id=class_id)
+
+    response = {
+        "message": "Marks updated successfully",
+        "saved": len(saved_cells),
+        "errors": errors,
+    }
+    if errors:
+        response["message"] = "Some marks could not be updated"
+        return Response(response, status=status.HTTP_207_MULTI_STATUS)
+
+    return Response(response, status=status.HTTP_200_OK)
 
 
 
@@ -1194,19 +1434,7 @@ def get_student_by_enr_no(request, exam_id, enr_no):
     )
 
     # Ensure obtained marks exist for this student and their class subjects
-    existing_marks = set(
-        models.ObtainedMark.objects.filter(
-            student=student,
-            paper__in=exam_papers
-        ).values_list('paper_id', flat=True)
-    )
-
-    new_marks = [
-        models.ObtainedMark(student=student, paper=paper, marks=0)
-        for paper in exam_papers if paper.id not in existing_marks
-    ]
-    if new_marks:
-        models.ObtainedMark.objects.bulk_create(new_marks)
+    ensure_obtained_marks(models.Student.objects.filter(id=student.id), exam_papers)
 
     # Fetch student's marks with clean annotations
     obtained_marks = models.ObtainedMark.objects.filter(
@@ -1266,44 +1494,45 @@ def get_student_by_enr_no(request, exam_id, enr_no):
 
 
 
+def get_student_search_summary(student):
+    return {
+        'student_id': student.id,
+        'enr_no': student.enrollmentId,
+        'student_name': student.student_full_name,
+        'father_name': student.father_full_name,
+        'class_name': student.classOfAdmission.className if student.classOfAdmission else None,
+        'roll_no': student.rollNo,
+    }
+
+
+
+@api_view(['GET'])
+def get_student_search(request, filter, search_key):
+    try:
+        limit = min(int(request.query_params.get('limit', 10)), 50)
+    except ValueError:
+        return Response({"message": "Invalid limit"}, status=status.HTTP_400_BAD_REQUEST)
+
+    students = models.Student.objects.select_related('classOfAdmission')
+    candidates = search_students(request.user.school, normalize_text(filter), search_key, limit=limit, students=students)
+
+    return Response([get_student_search_summary(student) for student in candidates], status=status.HTTP_200_OK)
+
+
+
+
+
 @api_view(['GET'])
 def get_student_report(request,exam_id, search_key, filter):
     # Normalize search key and filter
     search_key = normalize_text(search_key)
     filter = normalize_text(filter)
 
-    try:
-        student = None
-
-        if filter == 'name':
-            student = models.Student.objects.filter(
-                Q(student_full_name__icontains=search_key) |
-                Q(student_full_name__istartswith=search_key) |
-                Q(student_full_name__iexact=search_key)
-            ).first()
-
-        elif filter == 'enrollment_id':
-            student = models.Student.objects.filter(
-                Q(enrollmentId__icontains=search_key) |
-                Q(enrollmentId__istartswith=search_key) |
-                Q(enrollmentId__iexact=search_key)
-            ).first()
-
-        elif filter == 'name_father':
-            student = models.Student.objects.filter(
-                Q(student_father_combined_name__icontains=search_key) |
-                Q(student_father_combined_name__istartswith=search_key) |
-                Q(student_father_combined_name__iexact=search_key)
-            ).first()
-        else:
-            student = models.Student.objects.filter(
-                Q(enrollmentId__icontains=search_key) |
-                Q(enrollmentId__istartswith=search_key) |
-                Q(enrollmentId__iexact=search_key)
-            ).first()
-
-    except models.Student.DoesNotExist:
-        return Response({"message": "Student doesn't exist"}, status=status.HTTP_400_BAD_REQUEST) 
+    students = models.Student.objects.select_related('classOfAdmission')
+    candidates = search_students(request.user.school, filter, search_key, students=students)
+    if not candidates:
+        return Response({"message": "Student doesn't exist"}, status=status.HTTP_400_BAD_REQUEST)
+    student = candidates[0]
 
 
     try:
@@ -1326,9 +1555,19 @@ def get_student_report(request,exam_id, search_key, filter):
         paper_pass_marks = F('paper__pass_marks'),
     ).values('paper_name', 'paper_full_marks', 'paper_pass_marks', 'marks').order_by('paper_name')
 
+    result = models.ExamResult.objects.filter(student=student, exam=exam).values(
+        'total', 'full_marks', 'percentage', 'failed_papers', 'grade', 'class_rank'
+    ).first()
+    if result is None and refresh_exam_results(exam.id, [student.id]):
+        result = models.ExamResult.objects.filter(student=student, exam=exam).values(
+            'total', 'full_marks', 'percentage', 'failed_papers', 'grade', 'class_rank'
+        ).first()
+
     response_data = {
         'student_data': student_data,
-        'obtained_marks': obtained_marks
+        'obtained_marks': obtained_marks,
+        'result': result,
+        'candidates': [get_student_search_summary(candidate) for candidate in candidates],
     }
     # print(response_data['obtained_marks'])
 
@@ -1412,6 +1651,25 @@ def get_marks(request,exam_id, class_id):
 
 
 
+@api_view(['GET'])
+def get_results(request, exam_id, class_id=None):
+    exam = get_object_or_404(models.Exam, id=exam_id, school=request.user.school)
+
+    students = models.Student.objects.filter(school=request.user.school)
+    if class_id is not None:
+        students = students.filter(classOfAdmission_id=class_id)
+
+    results = list(compute_exam_results(exam, students))
+    for result in results:
+        result['result'] = 'Fail' if result['failed_papers'] else 'Pass'
+        if result['percentage'] is not None:
+            result['percentage'] = round(result['percentage'], 2)
+
+    return Response(results, status=status.HTTP_200_OK)
+
+
+
+
 @api_view(['GET'])
 def get_months(request):
     months = models.Month.objects.all()
@@ -1422,7 +1680,7 @@ def get_months(request):
 
 @api_view(['GET'])
 def get_new_receipt_no(request):
-    receipt_no = models.Receipt.get_new_receipt_no()
+    receipt_no = models.Receipt.get_new_receipt_no(request.user.school)
     return Response(receipt_no, status=status.HTTP_200_OK)
 
 
@@ -1430,38 +1688,30 @@ def get_new_receipt_no(request):
 @api_view(['GET'])
 def get_student_for_receipt(request, enr_no):
 
-    try:
-        student = models.Student.objects.annotate(
-            Roll_No = F('rollNo'),
-            Student_Name = F('student_full_name'),
-            Father_Name = F('father_full_name'),
-            Class_Name = F('classOfAdmission__className'),
-            monthly_fee = F('classOfAdmission__monthlyFees'),
-        ).values('id','Student_Name', 'Class_Name',  'Father_Name','Roll_No', 'monthly_fee').get(enrollmentId=enr_no)
-    except models.Student.DoesNotExist:
+    students = models.Student.objects.filter(enrollmentId=enr_no).annotate(
+        Roll_No = F('rollNo'),
+        Student_Name = F('student_full_name'),
+        Father_Name = F('father_full_name'),
+        Class_Name = F('classOfAdmission__className'),
+        monthly_fee = F('classOfAdmission__monthlyFees'),
+        fee_account_id = F('fee_account__id'),
+        old_fees = F('fee_account__outstanding_fees'),
+        paid_months = F('fee_account__paid_months'),
+    ).values('id','Student_Name', 'Class_Name',  'Father_Name','Roll_No', 'monthly_fee', 'fee_account_id', 'old_fees', 'paid_months')
+
+    student = students.first()
+    if student is None:
         return Response({"message": "Student doesn't exist"}, status=status.HTTP_400_BAD_REQUEST)
 
+    if student['fee_account_id'] is None:
+        # first visit since the ledger was introduced
+        refresh_fee_accounts([student['id']])
+        student = students.first()
 
-    try:
-        old_receipts = models.Receipt.objects.filter(student_id=student['id'])
-    except models.Receipt.DoesNotExist:
-        return Response({"message": "Receipt doesn't exist"}, status=status.HTTP_400_BAD_REQUEST)
-    else:
-        if old_receipts:
-            old_fees = float(old_receipts.aggregate(sum_total=Sum('remaining_fees'))['sum_total'])
-            months_paid = [ {'id':month.id, 'name':month.name}  for receipt in old_receipts for month in receipt.months.all()]
-        else:
-            old_fees = 0
-            months_paid = []
-            
-            
-    # print(months_paid)
-
+    student.pop('fee_account_id')
+    student['old_fees'] = float(student['old_fees'] or 0)
+    student['paid_months'] = student['paid_months'] or []
 
-    student['old_fees'] = old_fees
-    student['paid_months'] = months_paid
-
-    # print(student)
     return Response(student, status=status.HTTP_200_OK)
 
 
@@ -1481,27 +1731,15 @@ def create_receipt(request):
         return Response({"message": "Student doesn't exist"}, status=status.HTTP_400_BAD_REQUEST)
     
     months = data.get('months')
-    data = {key: value for key, value in data.items() if key not in ['student', 'months']}
-    
-    # print(data)
-    try:
-        old_receipts = models.Receipt.objects.filter(student=student)
-    except models.Receipt.DoesNotExist:
-        return Response({"message": "Receipt doesn't exist"}, status=status.HTTP_400_BAD_REQUEST)
-    else:
-        # print(old_receipts)
-        for receipt in old_receipts:
-            if receipt.remaining_fees > 0 and data['deposit_fees'] >= receipt.remaining_fees:
-                receipt.remaining_fees = 0
-                data['deposit_fees'] -= receipt.remaining_fees
-                receipt.save()
-        
-    
-    
-    receipt = models.Receipt.objects.create(**data, student=student)
+    data = {key: value for key, value in data.items() if key not in ['student', 'months', 'receipt_no', 'class_name']}
+    data['receipt_no'], = models.Receipt.allocate_receipt_nos(student.school)
 
-    for month in months:
-        receipt.months.add(month)
+    receipt = models.Receipt.objects.create(**data, student=student, class_name_id=student.classOfAdmission_id)
+    settle_old_receipts(receipt)
+
+    receipt.months.add(*(months or []))
+    refresh_fee_accounts([student.id])
+    refresh_fee_collections([(student.school_id, receipt.receipt_date)])
 
         
     response = {
@@ -1518,10 +1756,134 @@ def create_receipt(request):
 
 
 
+@api_view(['POST'])
+def create_receipts(request):
+    # {'receipt_date': ..., 'payment_mode': ..., 'receipts': [{'student': 47, 'months': [1], 'monthly_fees': ..., 'deposit_fees': ...}, ...]}
+    # top level values are shared by every entry; nothing is created unless every entry is valid
+    data = request.data
+    entries = data.get('receipts') if isinstance(data, dict) else None
+    if not isinstance(entries, list) or not entries:
+        return Response({"message": "A list of receipts is required"}, status=status.HTTP_400_BAD_REQUEST)
+
+    receipt_fields = {
+        field.name: field for field in models.Receipt._meta.concrete_fields
+        if field.name not in ('id', 'receipt_no', 'student', 'class_name', 'created_at')
+    }
+    shared = {key: value for key, value in data.items() if key in receipt_fields}
+
+    school = request.user.school
+    student_ids = set()
+    month_ids = set()
+    for entry in entries:
+        if isinstance(entry, dict):
+            student_ids.add(entry.get('student'))
+            month_ids.update(entry.get('months') or [])
+    students = models.Student.objects.filter(school=school).in_bulk([student_id for student_id in student_ids if isinstance(student_id, int)])
+    existing_month_ids = set(models.Month.objects.filter(id__in=[month_id for month_id in month_ids if isinstance(month_id, int)]).values_list('id', flat=True))
+
+    errors = {}
+    rows = []
+    seen_students = set()
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            errors[index] = "Invalid receipt data"
+            continue
+        student = students.get(entry.get('student'))
+        months = entry.get('months') or []
+        if student is None:
+            errors[index] = "Student doesn't exist"
+            continue
+        if student.id in seen_students:
+            errors[index] = "Student appears more than once"
+            continue
+        seen_students.add(student.id)
+        if not isinstance(months, list) or any(month_id not in existing_month_ids for month_id in months):
+            errors[index] = "Invalid months"
+            continue
+
+        values = {**shared, **{key: value for key, value in entry.items() if key in receipt_fields}}
+        try:
+            values = {key: receipt_fields[key].to_python(value) for key, value in values.items()}
+        except DjangoValidationError as e:
+            errors[index] = e.messages[0]
+            continue
+        rows.append((student, list(dict.fromkeys(months)), values))
+
+    if errors:
+        return Response({"message": "Some receipts are invalid", "errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    with transaction.atomic():
+        receipt_nos = models.Receipt.allocate_receipt_nos(school, count=len(rows))
+
+        receipts = [
+            models.Receipt(**values, student=student, class_name_id=student.classOfAdmission_id, receipt_no=receipt_no)
+            for (student, _, values), receipt_no in zip(rows, receipt_nos)
+        ]
+        models.Receipt.objects.bulk_create(receipts, batch_size=500)
+
+        if receipts[0].pk is None:
+            # backends that can't return ids from a bulk insert
+            receipt_ids = dict(models.Receipt.objects.filter(receipt_no__in=receipt_nos).values_list('receipt_no', 'id'))
+            for receipt in receipts:
+                receipt.pk = receipt_ids[receipt.receipt_no]
+
+        settle_dues(receipts)
+
+        ReceiptMonth = models.Receipt.months.through
+        ReceiptMonth.objects.bulk_create(
+            [
+                ReceiptMonth(receipt_id=receipt.pk, month_id=month_id)
+                for receipt, (_, months, _) in zip(receipts, rows)
+                for month_id in months
+            ],
+            batch_size=500,
+        )
+
+        refresh_fee_accounts(seen_students)
+        refresh_fee_collections({(school.id, receipt.receipt_date) for receipt in receipts})
+
+    response = {
+        "message": "Receipts created successfully",
+        "receipts": [{"student": receipt.student_id, "id": receipt.pk, "receipt_no": receipt.receipt_no} for receipt in receipts],
+    }
+    return Response(response, status=status.HTTP_201_CREATED)
+
+
+
+
 @api_view(['GET'])
 def get_receipts(request):
+    # ?date_from=&date_to=&class_id=&enrollment_id=&page_size=&cursor=; without page_size/cursor the whole list comes back
+    params = request.query_params
+    receipts = models.Receipt.objects.filter(student__school=request.user.school)
+    paginate = 'page_size' in params or 'cursor' in params
+
+    try:
+        page_size = get_page_size(request)
+        if params.get('date_from'):
+            receipts = receipts.filter(receipt_date__gte=params['date_from'])
+        if params.get('date_to'):
+            receipts = receipts.filter(receipt_date__lte=params['date_to'])
+        if params.get('class_id'):
+            receipts = receipts.filter(student__classOfAdmission_id=int(params['class_id']))
+        if params.get('enrollment_id'):
+            receipts = receipts.filter(student__enrollmentId=params['enrollment_id'])
+
+        # keyset pagination over (receipt_date desc nulls last, id desc)
+        if params.get('cursor'):
+            last_date, last_id = decode_cursor(params['cursor'])
+            if last_date is None:
+                receipts = receipts.filter(receipt_date__isnull=True, id__lt=last_id)
+            else:
+                receipts = receipts.filter(
+                    Q(receipt_date__lt=last_date) |
+                    Q(receipt_date=last_date, id__lt=last_id) |
+                    Q(receipt_date__isnull=True)
+                )
+    except (ValueError, TypeError, DjangoValidationError):
+        return Response({"message": "Invalid filter or cursor"}, status=status.HTTP_400_BAD_REQUEST)
 
-    receipts = models.Receipt.objects.select_related('student').prefetch_related('months').annotate(
+    receipts = receipts.annotate(
         receiptNo=F('receipt_no'),
         studentName=F('student__student_full_name'),
         className=F('student__classOfAdmission__className'),
@@ -1531,6 +1893,7 @@ def get_receipts(request):
         remainingFee=F('remaining_fees'),
         paid=F('deposit_fees'),
         netFees=F('net_fees'),
+        month_names=GroupConcat('months__name', separator='|'),
     ).values(
         'id',
         'receiptNo',
@@ -1543,265 +1906,357 @@ def get_receipts(request):
         'paid',
         'netFees',
         'remarks',
-        'months__name'
-    ).order_by('-date')
+        'month_names'
+    ).order_by(F('receipt_date').desc(nulls_last=True), '-id')
 
-    # Group months by receipt ID
-    receipts_dict = {}
-    for receipt in receipts:
-        receipt_id = receipt['id']
-        if receipt_id not in receipts_dict:
-            receipts_dict[receipt_id] = {**receipt, 'months': []}
-        receipts_dict[receipt_id]['months'].append(receipt['months__name'])
+    final_receipts = list(receipts[:page_size + 1] if paginate else receipts)
+    has_next = paginate and len(final_receipts) > page_size
+    if paginate:
+        final_receipts = final_receipts[:page_size]
 
-    final_receipts = list(receipts_dict.values())
+    for receipt in final_receipts:
+        month_names = receipt.pop('month_names')
+        receipt['months'] = month_names.split('|') if month_names else []
 
-    return Response(final_receipts, status=status.HTTP_200_OK)
+    if not paginate:
+        return Response(final_receipts, status=status.HTTP_200_OK)
 
+    next_cursor = None
+    if has_next:
+        last_receipt = final_receipts[-1]
+        next_cursor = encode_cursor(last_receipt['date'], last_receipt['id'])
 
+    return Response({"results": final_receipts, "next_cursor": next_cursor}, status=status.HTTP_200_OK)
 
 
-@api_view(['DELETE'])
-def delete_receipt(request):
-    # print(request.data)
-    for receipt_id in request.data:
+
+
+@api_view(['GET'])
+def get_fee_dues_report(request, class_id=None):
+    # ?until_month=&include_paid=&page_size=&cursor=&export=csv|xlsx
+    params = request.query_params
+    students = models.Student.objects.filter(school=request.user.school)
+    if class_id is not None:
+        students = students.filter(classOfAdmission_id=class_id)
+
+    try:
+        until_month = int(params['until_month']) if params.get('until_month') else None
+        page_size = get_page_size(request, default=100, maximum=500)
+        students, due_months = get_fee_dues(students, until_month)
+        if params.get('include_paid') not in ('1', 'true'):
+            students = students.filter(expected_total__gt=0)
+        students = students.order_by('classOfAdmission_id', 'id')
+        if params.get('cursor'):
+            last_class_id, last_id = decode_cursor(params['cursor'])
+            students = students.filter(
+                Q(classOfAdmission_id__gt=last_class_id) |
+                Q(classOfAdmission_id=last_class_id, id__gt=last_id)
+            )
+    except (ValueError, TypeError):
+        return Response({"message": "Invalid filter or cursor"}, status=status.HTTP_400_BAD_REQUEST)
+
+    fields = ['student_id', 'enr_no', 'roll_no', 'student_name', 'class_id', 'class_name', 'monthly_fee',
+              'outstanding_fees', 'unpaid_months_count', 'expected_total', 'paid_month_ids']
+    month_names = dict(due_months)
+
+    def get_unpaid_months(paid_month_ids):
+        paid = {int(month_id) for month_id in paid_month_ids.split(',')} if paid_month_ids else set()
+        return [name for month_id, name in month_names.items() if month_id not in paid]
+
+    if params.get('export'):
+        header = ['Enrollment ID', 'Roll No', 'Student Name', 'Class', 'Monthly Fee', 'Outstanding Fees', 'Unpaid Months', 'Expected Total']
+        rows = (
+            [due['enr_no'], due['roll_no'], due['student_name'], due['class_name'], due['monthly_fee'],
+             due['outstanding_fees'], ' '.join(get_unpaid_months(due['paid_month_ids'])), due['expected_total']]
+            for due in students.values(*fields).iterator(chunk_size=500)
+        )
         try:
-            receipt = models.Receipt.objects.get(id=receipt_id)
-        except models.Receipt.DoesNotExist:
-            return Response({"message": f"Receipt with id {receipt_id} doesn't exist"}, status=status.HTTP_400_BAD_REQUEST)
-        receipt.delete()
+            return export_rows(header, rows, 'fee_dues', params['export'])
+        except ValueError as e:
+            return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    return Response({"message": "Receipt deleted successfully"}, status=status.HTTP_204_NO_CONTENT)
+    dues = list(students.values(*fields)[:page_size + 1])
+    next_cursor = encode_cursor(dues[page_size - 1]['class_id'], dues[page_size - 1]['student_id']) if len(dues) > page_size else None
+    dues = dues[:page_size]
+    for due in dues:
+        due['unpaid_months'] = get_unpaid_months(due.pop('paid_month_ids'))
 
+    return Response({"results": dues, "next_cursor": next_cursor}, status=status.HTTP_200_OK)
 
 
 
 
 @api_view(['GET'])
-def get_students_for_attendance(request, date, class_id):
-    from datetime import datetime
-    date = datetime.strptime(date, '%Y-%m-%d').date()
-    
-    try:
-        students = models.Student.objects.filter(classOfAdmission__id=class_id)
-    except models.Class.DoesNotExist:
-        return Response({"message": "Class doesn't exist"}, status=status.HTTP_400_BAD_REQUEST)
-    except Exception as e:
-        return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+def get_fee_collection_summary(request):
+    # ?date_from=&date_to=&group_by=class,payment_mode,day,month (defaults to the current month by class)
+    params = request.query_params
+    group_fields = {
+        'class': ['class_id', 'className'],
+        'payment_mode': ['payment_mode'],
+        'day': ['date'],
+        'month': ['month'],
+    }
+    group_by = [key for key in params.get('group_by', 'class').split(',') if key]
+    if not group_by or any(key not in group_fields for key in group_by):
+        return Response({"message": f"group_by must be a combination of {', '.join(group_fields)}"}, status=status.HTTP_400_BAD_REQUEST)
 
+    if params.get('date_from') or params.get('date_to'):
+        date_from, date_to = params.get('date_from'), params.get('date_to')
+    else:
+        today = timezone.localdate()
+        start, end = get_date_range(today.year, today.month)
+        date_from, date_to = start, end - timedelta(days=1)
+
+    collections = models.FeeCollection.objects.filter(school=request.user.school)
     try:
-        attendances = models.Attendance.objects.filter(date=date, student__classOfAdmission__id=class_id).annotate(
-                    rollNo = F('student__rollNo'),
-                    enrollmentId = F('student__enrollmentId'),
-                    name = F('student__student_full_name'),
-                    fatherName = F('student__father_full_name'),
-                    gender = F('student__gender'),
-        )
-        for student in students:
-            if not attendances.filter(student=student).exists():
-                try:
-                    models.Attendance.objects.create(
-                        student=student,
-                        date=date,
-                        status=''
-                    )
-                except Exception as e:
-                    return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
-        attendances = attendances.values(
-                    'id',
-                    'rollNo',
-                    'enrollmentId',
-                    'name',
-                    'fatherName',
-                    'gender',
-                    'status'
-                )   
-        
-                 
-    except models.Attendance.DoesNotExist:
-        return Response({"message": "Attendance doesn't exist"}, status=status.HTTP_400_BAD_REQUEST)
+        if date_from:
+            collections = collections.filter(date__gte=date_from)
+        if date_to:
+            collections = collections.filter(date__lte=date_to)
+    except DjangoValidationError:
+        return Response({"message": "Dates must be in YYYY-MM-DD format"}, status=status.HTTP_400_BAD_REQUEST)
 
-    if attendances.exists():
-        return Response(list(attendances), status=status.HTTP_200_OK)
-    
+    fields = [field for key in group_by for field in group_fields[key]]
+    summary = collections.annotate(
+        class_id=F('class_name_id'),
+        month=TruncMonth('date'),
+        className=F('class_name__className'),
+    ).values(*fields).annotate(
+        receipt_count=Sum('receipt_count'),
+        deposit_fees=Sum('deposit_fees'),
+        concession_amount=Sum('concession_amount'),
+        net_fees=Sum('net_fees'),
+    ).order_by(*fields)
 
-    
+    return Response({"date_from": date_from, "date_to": date_to, "results": summary}, status=status.HTTP_200_OK)
 
-    for student in students:
-        try:
-            models.Attendance.objects.create(
-                student=student,
-                date=date,
-                status=''
-            )
-        except Exception as e:
-            return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        
-    
 
-    try:    
-        attendances = models.Attendance.objects.filter(date=date, student__classOfAdmission__id=class_id).annotate(
-            rollNo = F('student__rollNo'),
-            enrollmentId = F('student__enrollmentId'),
-            name = F('student__student_full_name'),
-            fatherName = F('student__father_full_name'),
-            gender = F('student__gender'),
 
-        ).values(
-            'id',
-            'rollNo',
-            'enrollmentId',
-            'name',
-            'fatherName',
-            'gender',
-            'status'
-        )
-    except Exception as e:
-        return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    
+def get_document_response(rendered, archive_name):
+    if len(rendered) == 1:
+        filename, pdf = rendered[0]
+        response = HttpResponse(pdf, content_type='application/pdf')
+        response['Content-Disposition'] = f'inline; filename="{filename}"'
+        return response
 
+    response = HttpResponse(bundle_documents(rendered), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{archive_name}"'
+    return response
 
-    return Response(list(attendances), status=status.HTTP_200_OK)
 
 
+@api_view(['GET'])
+def get_receipt_pdf(request, receipt_id):
+    receipts = models.Receipt.objects.filter(id=receipt_id, student__school=request.user.school)
+    documents = get_receipt_documents(receipts)
+    if not documents:
+        return Response({"message": "Receipt doesn't exist"}, status=status.HTTP_404_NOT_FOUND)
+    return get_document_response(render_documents(documents), 'receipts.zip')
 
 
 
 @api_view(['POST'])
-def update_attendance(request):
-    attendances = request.data
-    for attendance in attendances:
-        try:
-            models.Attendance.objects.filter(id=attendance['id']).update(status=attendance['status'])
-        except Exception as e:
-            return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    
-
-    return Response({"message": "Attendance updated successfully"}, status=status.HTTP_200_OK)
-
+def print_receipts(request):
+    # {'receipt_ids': [...]} or {'class_id': 2, 'date_from': ..., 'date_to': ...}; several receipts come back as a zip
+    data = request.data
+    receipts = models.Receipt.objects.filter(student__school=request.user.school)
+    try:
+        if data.get('receipt_ids'):
+            receipts = receipts.filter(id__in=[int(receipt_id) for receipt_id in data['receipt_ids']])
+        elif data.get('class_id'):
+            receipts = receipts.filter(student__classOfAdmission_id=int(data['class_id']))
+            if data.get('date_from'):
+                receipts = receipts.filter(receipt_date__gte=data['date_from'])
+            if data.get('date_to'):
+                receipts = receipts.filter(receipt_date__lte=data['date_to'])
+        else:
+            return Response({"message": "receipt_ids or class_id is required"}, status=status.HTTP_400_BAD_REQUEST)
+    except (TypeError, ValueError, DjangoValidationError):
+        return Response({"message": "Invalid receipt filter"}, status=status.HTTP_400_BAD_REQUEST)
 
+    documents = get_receipt_documents(receipts)
+    if not documents:
+        return Response({"message": "No receipts found"}, status=status.HTTP_404_NOT_FOUND)
+    return get_document_response(render_documents(documents), 'receipts.zip')
 
 
 
 @api_view(['GET'])
-def get_class_attendance_by_month(request, year, month, class_id):
-    
+def get_fee_statement_pdf(request, student_id):
+    # ?date_from=&date_to=
+    students = models.Student.objects.filter(id=student_id, school=request.user.school)
     try:
-        attendances = models.Attendance.objects.filter(student__classOfAdmission__id=class_id, date__year=year, date__month=month).annotate(
-            rollNo = F('student__rollNo'),
-            name = F('student__student_full_name'),
-            className = F('student__classOfAdmission__className'),
-        ).values(
-            'rollNo',
-            'name',
-            'className',
-            'status',
-            'date',
-         
-        ).order_by('date')
-    except models.Attendance.DoesNotExist:
-        return Response({"message": "Attendance doesn't exist"}, status=status.HTTP_400_BAD_REQUEST)
+        documents = get_statement_documents(students, request.query_params.get('date_from'), request.query_params.get('date_to'))
+    except DjangoValidationError:
+        return Response({"message": "Dates must be in YYYY-MM-DD format"}, status=status.HTTP_400_BAD_REQUEST)
+    if not documents:
+        return Response({"message": "Student doesn't exist"}, status=status.HTTP_404_NOT_FOUND)
+    return get_document_response(render_documents(documents), 'statements.zip')
 
-    if not attendances.exists():
-        return Response({"message": "Attendance doesn't exist for this month"}, status=status.HTTP_404_NOT_FOUND)
 
-    response = {}
-    for attendance in attendances:
-        roll_no = attendance['rollNo']
-        day = attendance['date'].day  # Extract the day from the date
 
-        if roll_no not in response:
-            response[roll_no] = {
-                "rollNo": roll_no,
-                "name": attendance['name'],
-                "className": attendance['className'],
-                "status": {
-                    day: attendance['status']
-                },
-            }
+@api_view(['POST'])
+def print_fee_statements(request):
+    # {'class_id': 2} or {'student_ids': [...]}, plus optional 'date_from'/'date_to'
+    data = request.data
+    students = models.Student.objects.filter(school=request.user.school)
+    try:
+        if data.get('student_ids'):
+            students = students.filter(id__in=[int(student_id) for student_id in data['student_ids']])
+        elif data.get('class_id'):
+            students = students.filter(classOfAdmission_id=int(data['class_id']))
         else:
-            # Add or update the status for the specific day
-            response[roll_no]['status'][day] = attendance['status']
-       
+            return Response({"message": "student_ids or class_id is required"}, status=status.HTTP_400_BAD_REQUEST)
+        documents = get_statement_documents(students, data.get('date_from'), data.get('date_to'))
+    except (TypeError, ValueError, DjangoValidationError):
+        return Response({"message": "Invalid statement filter"}, status=status.HTTP_400_BAD_REQUEST)
+
+    if not documents:
+        return Response({"message": "No students found"}, status=status.HTTP_404_NOT_FOUND)
+    return get_document_response(render_documents(documents), 'statements.zip')
 
-    
-    for rollNo in response:
-        response[rollNo]['totalP'] = list(response[rollNo]['status'].values()).count('P')
-        response[rollNo]['totalA'] = list(response[rollNo]['status'].values()).count('A')
-        response[rollNo]['totalL'] = list(response[rollNo]['status'].values()).count('L')
-        
 
 
-    return Response(list(response.values()), status=status.HTTP_200_OK)
+
+@api_view(['DELETE'])
+def delete_receipt(request):
+    # body: [receipt_id, ...]; nothing is deleted unless every id belongs to the school
+    receipt_ids = request.data
+    if not isinstance(receipt_ids, list) or not receipt_ids:
+        return Response({"message": "A list of receipt ids is required"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        receipt_ids = list(dict.fromkeys(int(receipt_id) for receipt_id in receipt_ids))
+    except (TypeError, ValueError):
+        return Response({"message": "Receipt ids must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+
+    with transaction.atomic():
+        receipts = {
+            receipt['id']: receipt
+            for receipt in models.Receipt.objects.select_for_update().filter(
+                id__in=receipt_ids, student__school=request.user.school
+            ).values('id', 'student_id', 'receipt_date')
+        }
+        missing = [receipt_id for receipt_id in receipt_ids if receipt_id not in receipts]
+        if missing:
+            results = [
+                {"id": receipt_id, "status": "not_found" if receipt_id in missing else "skipped"}
+                for receipt_id in receipt_ids
+            ]
+            return Response({"message": f"Receipts {missing} don't exist", "results": results}, status=status.HTTP_400_BAD_REQUEST)
+
+        # dues these receipts cleared on the student's other receipts come back
+        restored_dues = defaultdict(Decimal)
+        for settled_receipt_id, amount in models.ReceiptSettlement.objects.filter(
+            receipt_id__in=receipt_ids
+        ).exclude(settled_receipt_id__in=receipt_ids).values_list('settled_receipt_id', 'amount'):
+            restored_dues[settled_receipt_id] += amount
+        settled_receipts = list(models.Receipt.objects.select_for_update().filter(id__in=restored_dues).only('id', 'remaining_fees'))
+        for settled_receipt in settled_receipts:
+            settled_receipt.remaining_fees = (settled_receipt.remaining_fees or 0) + restored_dues[settled_receipt.id]
+        models.Receipt.objects.bulk_update(settled_receipts, ['remaining_fees'], batch_size=500)
+
+        # the receipt-month and settlement rows go with a single DELETE ... WHERE receipt_id IN (...) each
+        models.Receipt.objects.filter(id__in=receipt_ids).delete()
+
+        school_id = request.user.school.id
+        refresh_fee_accounts({receipt['student_id'] for receipt in receipts.values()})
+        refresh_fee_collections({(school_id, receipt['receipt_date']) for receipt in receipts.values()})
+
+    results = [{"id": receipt_id, "status": "deleted"} for receipt_id in receipt_ids]
+    return Response({"message": "Receipts deleted successfully", "results": results}, status=status.HTTP_200_OK)
+
+
 
 
 
 @api_view(['GET'])
-def get_class_attendance_by_month_search_term(request, year, month, search_type, search_term):
-    if search_type == '' or search_term == '':
-        return Response({"message": "Search type and search term are required"}, status=status.HTTP_400_BAD_REQUEST)
-    
+def get_students_for_attendance(request, date, class_id):
+    from datetime import datetime
+    date = datetime.strptime(date, '%Y-%m-%d').date()
+
     try:
-        if search_type == 'name':
-            attendances = models.Attendance.objects.filter(student__student_full_name__icontains = search_term, date__year=year, date__month=month)
+        ensure_attendance_sheet(class_id, date)
+    except Exception as e:
+        return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        elif search_type == 'enrNo':
-            attendances = models.Attendance.objects.filter(student__enrollmentId = search_term, date__year=year, date__month=month)
-        else:
-            return Response({"message": "Invalid search type"}, status=status.HTTP_400_BAD_REQUEST)
-        
-        attendances = attendances.annotate(
-                rollNo = F('student__rollNo'),
-                name = F('student__student_full_name'),
-                className = F('student__classOfAdmission__className'),
-                ).values(
-                    'rollNo',
-                    'name',
-                    'className',
-                    'status',
-                    'date',
-                
-                ).order_by('date')
+    attendances = models.Attendance.objects.filter(date=date, student__classOfAdmission__id=class_id).annotate(
+        rollNo = F('student__rollNo'),
+        enrollmentId = F('student__enrollmentId'),
+        name = F('student__student_full_name'),
+        fatherName = F('student__father_full_name'),
+        gender = F('student__gender'),
+    ).values(
+        'id',
+        'rollNo',
+        'enrollmentId',
+        'name',
+        'fatherName',
+        'gender',
+        'status'
+    ).order_by('rollNo', 'name')
 
-    except models.Attendance.DoesNotExist:
-        return Response({"message": "Attendance doesn't exist"}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(list(attendances), status=status.HTTP_200_OK)
 
 
 
-    if not attendances.exists():
+
+
+@api_view(['POST'])
+def update_attendance(request):
+    try:
+        results, _ = bulk_update_attendance_status(models.Attendance, request.data, {'student__school': request.user.school})
+    except ValueError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    if any(not result['updated'] for result in results):
+        return Response({"message": "Some attendances could not be updated", "results": results}, status=status.HTTP_207_MULTI_STATUS)
+
+    return Response({"message": "Attendance updated successfully", "results": results}, status=status.HTTP_200_OK)
+
+
+
+
+
+@api_view(['GET'])
+def get_class_attendance_by_month(request, year, month, class_id):
+    if not 1 <= month <= 12:
+        return Response({"message": "Invalid month"}, status=status.HTTP_400_BAD_REQUEST)
+
+    students = models.Student.objects.filter(classOfAdmission__id=class_id)
+    response = get_monthly_attendance_register(students, year, month)
+
+    if not response:
         return Response({"message": "Attendance doesn't exist for this month"}, status=status.HTTP_404_NOT_FOUND)
 
-    response = {}
-    for attendance in attendances:
-        roll_no = attendance['rollNo']
-        day = attendance['date'].day  # Extract the day from the date
+    return Response(response, status=status.HTTP_200_OK)
+
 
-        if roll_no not in response:
-            response[roll_no] = {
-                "rollNo": roll_no,
-                "name": attendance['name'],
-                "className": attendance['className'],
-                "status": {
-                    day: attendance['status']
-                },
-            }
-        else:
-            # Add or update the status for the specific day
-            response[roll_no]['status'][day] = attendance['status']
-       
 
+@api_view(['GET'])
+def get_class_attendance_by_month_search_term(request, year, month, search_type, search_term):
+    if search_type == '' or search_term == '':
+        return Response({"message": "Search type and search term are required"}, status=status.HTTP_400_BAD_REQUEST)
+    if not 1 <= month <= 12:
+        return Response({"message": "Invalid month"}, status=status.HTTP_400_BAD_REQUEST)
     
-    for rollNo in response:
-        response[rollNo]['totalP'] = list(response[rollNo]['status'].values()).count('P')
-        response[rollNo]['totalA'] = list(response[rollNo]['status'].values()).count('A')
-        response[rollNo]['totalL'] = list(response[rollNo]['status'].values()).count('L')
-        
+    students = models.Student.objects.filter(school=request.user.school)
+    if search_type == 'name':
+        matches = search_students(request.user.school, 'name', search_term, limit=50)
+        students = students.filter(id__in=[student.id for student in matches])
+    elif search_type == 'enrNo':
+        students = students.filter(enrollmentId = search_term)
+    else:
+        return Response({"message": "Invalid search type"}, status=status.HTTP_400_BAD_REQUEST)
 
+    response = get_monthly_attendance_register(students, year, month)
 
-    return Response(list(response.values()), status=status.HTTP_200_OK)
-    # return Response("ok", status=status.HTTP_200_OK)
+    if not response:
+        return Response({"message": "Attendance doesn't exist for this month"}, status=status.HTTP_404_NOT_FOUND)
+
+    return Response(response, status=status.HTTP_200_OK)
 
 
 
@@ -1894,24 +2349,29 @@ def get_employees_for_attendance(request, date):
 
 @api_view(['POST'])
 def update_employee_attendance(request):
-    attendances = request.data
-    for attendance in attendances:
-        try:
-            models.EmployeeAttendance.objects.filter(id=attendance['id']).update(status=attendance['status'])
-        except Exception as e:
-            return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-    
+    try:
+        results, _ = bulk_update_attendance_status(models.EmployeeAttendance, request.data, {'employee__school': request.user.school})
+    except ValueError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({"message": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    return Response({"message": "Employee Attendance updated successfully"}, status=status.HTTP_200_OK)
+    if any(not result['updated'] for result in results):
+        return Response({"message": "Some attendances could not be updated", "results": results}, status=status.HTTP_207_MULTI_STATUS)
+
+    return Response({"message": "Employee Attendance updated successfully", "results": results}, status=status.HTTP_200_OK)
 
 
 
 
 @api_view(['GET'])
 def get_employee_attendance_by_month(request, year, month):
-    
+    if not 1 <= month <= 12:
+        return Response({"message": "Invalid month"}, status=status.HTTP_400_BAD_REQUEST)
+
     try:
-        attendances = models.EmployeeAttendance.objects.filter(employee__school=request.user.school, date__year=year, date__month=month).annotate(
+        start, end = get_date_range(year, month)
+        attendances = models.EmployeeAttendance.objects.filter(employee__school=request.user.school, date__gte=start, date__lt=end).annotate(
             employeeId = F('employee__employeeId'),
             name = F('employee__employee_full_name'),
             role = F('employee__selectRole'),
@@ -1966,10 +2426,14 @@ def get_employee_attendance_by_month(request, year, month):
 def get_employee_attendance_by_month_search_term(request, year, month, search_type, search_term):
     if search_type == '' or search_term == '':
         return Response({"message": "Search type and search term are required"}, status=status.HTTP_400_BAD_REQUEST)
+    if not 1 <= month <= 12:
+        return Response({"message": "Invalid month"}, status=status.HTTP_400_BAD_REQUEST)
     
+    start, end = get_date_range(year, month)
     filters = {
-        'date__year': year,
-        'date__month': month
+        'employee__school': request.user.school,
+        'date__gte': start,
+        'date__lt': end
     }
     
     if search_type == 'name':
@@ -2039,9 +2503,148 @@ def get_employee_attendance_by_month_search_term(request, year, month, search_ty
 
 
 
+# exports: ?export=csv (default, streamed) or ?export=xlsx
 
+STUDENT_EXPORT_FIELDS = [
+    field.name for field in models.Student._meta.concrete_fields
+    if field.name not in ('school', 'classOfAdmission', 'photo', 'search_name', 'search_name_father')
+]
 
+EMPLOYEE_EXPORT_FIELDS = [
+    field.name for field in models.Employee._meta.concrete_fields
+    if field.name not in ('school', 'selectRole', 'mainSubject', 'photoUpload', 'bioData')
+]
 
 
+def filter_export_class(students, class_id):
+    """Narrow an export to the ?class_id= class when given; raises ValueError for a non-numeric id."""
+    if not class_id:
+        return students
+    if not class_id.isdigit():
+        raise ValueError("class_id must be a number")
+    return students.filter(classOfAdmission_id=int(class_id))
+
+
+
+@api_view(['GET'])
+def export_students(request):
+    # ?class_id=
+    students = models.Student.objects.filter(school=request.user.school)
+    try:
+        students = filter_export_class(students, request.query_params.get('class_id'))
+        rows = students.order_by('classOfAdmission__className', 'rollNo', 'id').values_list(
+            'classOfAdmission__className', *STUDENT_EXPORT_FIELDS
+        ).iterator(chunk_size=2000)
+        return export_rows(['className', *STUDENT_EXPORT_FIELDS], rows, 'students', request.query_params.get('export', 'csv'))
+    except ValueError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
+
+@api_view(['GET'])
+def export_employees(request):
+    subjects = models.Employee.complementarySubjects.through.objects.filter(
+        employee=OuterRef('pk')
+    ).values('employee').annotate(names=GroupConcat('subject__subjectName', separator=', ')).values('names')
+
+    rows = models.Employee.objects.filter(school=request.user.school).annotate(
+        complementary_subjects=Subquery(subjects),
+    ).order_by('employee_full_name', 'id').values_list(
+        *EMPLOYEE_EXPORT_FIELDS, 'selectRole__name', 'mainSubject__subjectName', 'complementary_subjects'
+    ).iterator(chunk_size=2000)
+    header = [*EMPLOYEE_EXPORT_FIELDS, 'role', 'mainSubject', 'complementarySubjects']
+    try:
+        return export_rows(header, rows, 'employees', request.query_params.get('export', 'csv'))
+    except ValueError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+
+@api_view(['GET'])
+def export_attendance_register(request, year, month):
+    # ?class_id=; one row per student with a column per day
+    if not 1 <= month <= 12:
+        return Response({"message": "Invalid month"}, status=status.HTTP_400_BAD_REQUEST)
+    days_in_month = calendar.monthrange(year, month)[1]
+
+    students = models.Student.objects.filter(school=request.user.school)
+    header = ['Class', 'Roll No', 'Name', *range(1, days_in_month + 1), 'P', 'A', 'L']
+    try:
+        students = filter_export_class(students, request.query_params.get('class_id'))
+        register = get_monthly_attendance_rows(students, year, month).order_by('className', 'rollNo', 'name')
+        rows = (
+            [row['className'], row['rollNo'], row['name'], *models.MonthlyAttendance.unpack(row['packed_statuses'], days_in_month),
+             row['totalP'], row['totalA'], row['totalL']]
+            for row in register.iterator(chunk_size=2000)
+        )
+        return export_rows(header, rows, f'attendance-{year}-{month:02d}', request.query_params.get('export', 'csv'))
+    except ValueError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+
+@api_view(['GET'])
+def export_employee_attendance_register(request, year, month):
+    if not 1 <= month <= 12:
+        return Response({"message": "Invalid month"}, status=status.HTTP_400_BAD_REQUEST)
+    days_in_month = calendar.monthrange(year, month)[1]
+    start, end = get_date_range(year, month)
+
+    attendances = models.EmployeeAttendance.objects.filter(
+        employee__school=request.user.school, date__gte=start, date__lt=end
+    ).order_by('employee__employee_full_name', 'employee_id', 'date').values_list(
+        'employee_id', 'employee__employeeId', 'employee__employee_full_name', 'date', 'status'
+    ).iterator(chunk_size=2000)
+
+    def get_rows():
+        # rows arrive grouped by employee, so only one employee's month is held at a time
+        for (_, employee_id, name), days in groupby(attendances, key=lambda attendance: attendance[:3]):
+            statuses = ['-'] * days_in_month
+            for *_, date, attendance_status in days:
+                statuses[date.day - 1] = attendance_status or '-'
+            yield [employee_id, name, *statuses, statuses.count('P'), statuses.count('A'), statuses.count('L')]
+
+    header = ['Employee ID', 'Name', *range(1, days_in_month + 1), 'P', 'A', 'L']
+    try:
+        return export_rows(header, get_rows(), f'employee-attendance-{year}-{month:02d}', request.query_params.get('export', 'csv'))
+    except ValueError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+
+@api_view(['GET'])
+def export_marks(request, exam_id, class_id):
+    # marks tabulation of a class: a column per paper plus the ExamResult snapshot
+    exam = get_object_or_404(models.Exam, id=exam_id, school=request.user.school)
+    papers = list(models.ExamPaper.objects.filter(exam=exam, subject__class_name_id=class_id).order_by('id').values_list('id', 'subject__subject__subjectName'))
+    paper_columns = {paper_id: index for index, (paper_id, _) in enumerate(papers)}
+
+    results = {
+        result['student_id']: result
+        for result in models.ExamResult.objects.filter(exam=exam, class_name_id=class_id).values(
+            'student_id', 'total', 'full_marks', 'percentage', 'grade', 'class_rank'
+        )
+    }
+
+    marks = models.ObtainedMark.objects.filter(
+        paper__in=paper_columns, student__classOfAdmission_id=class_id
+    ).order_by('student__rollNo', 'student_id').values_list(
+        'student_id', 'student__rollNo', 'student__enrollmentId', 'student__student_full_name', 'paper_id', 'marks'
+    ).iterator(chunk_size=2000)
+
+    def get_rows():
+        for (student_id, roll_no, enrollment_id, name), student_marks in groupby(marks, key=lambda mark: mark[:4]):
+            row = [None] * len(papers)
+            for *_, paper_id, obtained in student_marks:
+                row[paper_columns[paper_id]] = obtained
+            result = results.get(student_id, {})
+            yield [
+                roll_no, enrollment_id, name, *row, result.get('total'), result.get('full_marks'),
+                result.get('percentage'), result.get('grade'), result.get('class_rank'),
+            ]
+
+    header = ['Roll No', 'Enrollment ID', 'Name', *(subject for _, subject in papers), 'Total', 'Full Marks', 'Percentage', 'Grade', 'Rank']
+    try:
+        return export_rows(header, get_rows(), f'marks-{exam_id}-{class_id}', request.query_params.get('export', 'csv'))
+    except ValueError as e:
+        return Response({"message": str(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -135,6 +135,15 @@ DATABASES = {
 AUTH_USER_MODEL = 'apis.AdminUser'
 
 
+# Student search backend used by apis.search: 'prefix', 'fts5' (SQLite) or 'trigram' (PostgreSQL)
+STUDENT_SEARCH_BACKEND = 'prefix'
+
+# Rendered receipt/statement PDFs used by apis.documents, cached by content hash (defaults to MEDIA_ROOT/documents)
+DOCUMENT_CACHE_DIR = None
+DOCUMENT_CACHE_MAX_SIZE = 512 * 1024 * 1024  # bytes, least recently used PDFs are pruned past this
+DOCUMENT_RENDER_WORKERS = None  # process pool size for batch printing, defaults to the CPU count; 0 renders in process
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 